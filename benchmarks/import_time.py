@@ -0,0 +1,67 @@
+"""
+Import-time budget of the dataprep entry points.
+
+Each module is imported in a fresh interpreter several times and the fastest run is compared with
+its budget. The heavy dependencies must not be loaded by the import at all; they are imported by
+the functions that need them. Exits with status 1 when a budget is exceeded or a heavy module is
+loaded, so it can gate CI:
+
+    python benchmarks/import_time.py
+"""
+import sys
+import json
+import argparse
+import subprocess
+
+# Seconds, with headroom over a typical laptop (video_extraction ~0.12 s, dominated by NumPy)
+IMPORT_BUDGETS = {
+    "dataprep.video_extraction": 0.3,
+    "dataprep.yolo_prep": 0.1,
+    "dataprep.json2dlc": 0.1,
+}
+
+HEAVY_MODULES = ("deeplabcut", "sklearn", "yaml", "cv2", "pandas", "tensorflow", "torch")
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module, repeat=5):
+    """
+    Import `module` in `repeat` fresh interpreters.
+
+    Returns:
+        dict: "seconds" of the fastest import and the heavy modules it "loaded".
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return min(runs, key=lambda run: run["seconds"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh imports per module.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget, e.g. for slow runners.")
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget in IMPORT_BUDGETS.items():
+        result = measure_import(module, args.repeat)
+        budget *= args.scale
+        ok = result["seconds"] <= budget and not result["loaded"]
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {module}: {result['seconds'] * 1000:.0f} ms (budget {budget * 1000:.0f} ms)"
+              + (f", loaded {', '.join(result['loaded'])}" if result["loaded"] else ""))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
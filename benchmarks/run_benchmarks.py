@@ -0,0 +1,220 @@
+"""
+Benchmark the dataprep pipeline on synthetic data and report throughput and peak memory as JSON.
+
+Synthetic videos, frames, a COCO keypoint export and a CVAT-style YOLO ZIP are generated once in the
+work folder (and reused while the settings are unchanged). Each case then runs in a fresh process,
+so its peak RSS is its own:
+
+    python benchmarks/run_benchmarks.py --frames 3000 --width 640 --height 480 --output results.json
+
+Cases: extract_<method> for every method of `extract_frames`, kmeans_frame_selection, copy_images
+and prepare_yolo_dataset. Each result has "seconds" (fastest of --repeat runs), "peak_rss_mb" and
+the throughputs that apply: "frames_per_s" (frames decoded or scanned), "files_per_s" (files
+written or placed) and "mb_per_s" (MB written or placed). Extraction cases report "decoded_exact":
+with OpenCV the frames decoded inside seeks are not counted, so compare decode work with PyAV.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import subprocess
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic  # noqa: E402
+
+EXTRACT_METHODS = ("uniform", "random", "kmeans", "global_kmeans", "motion")
+CASES = tuple(f"extract_{method}" for method in EXTRACT_METHODS) + (
+    "kmeans_frame_selection", "copy_images", "prepare_yolo_dataset")
+
+
+def prepare_data(args):
+    """Generate the synthetic inputs into `args.workdir`/data unless they exist for the same settings."""
+    data = os.path.join(args.workdir, "data")
+    settings = {key: getattr(args, key) for key in ("videos", "frames", "width", "height", "gop", "images",
+                                                    "boxes", "seed")}
+    marker = os.path.join(data, "settings.json")
+    if os.path.exists(marker):
+        with open(marker, 'r') as f:
+            if json.load(f) == settings:
+                return data
+    shutil.rmtree(data, ignore_errors=True)
+    os.makedirs(os.path.join(data, "videos"))
+
+    start = time.perf_counter()
+    for v in range(args.videos):
+        synthetic.make_video(os.path.join(data, "videos", f"video{v:02d}.mp4"), args.frames, args.width, args.height,
+                             gop=args.gop, seed=args.seed + v)
+    videos = [f"video{v:02d}" for v in range(args.videos)]
+    names = synthetic.frame_names(videos, -(-args.images // args.videos))[:args.images]
+    synthetic.make_frames(os.path.join(data, "frames"), names, args.width, args.height, args.seed)
+    os.makedirs(os.path.join(data, "coco"))
+    synthetic.make_coco(os.path.join(data, "coco", "annotations.json"), names, args.width, args.height,
+                        seed=args.seed)
+    synthetic.make_yolo_zip(os.path.join(data, "export.zip"), names, args.boxes, args.seed)
+
+    with open(marker, 'w') as f:
+        json.dump(settings, f)
+    print(f"Generated synthetic data in {data} ({time.perf_counter() - start:.1f}s)", file=sys.stderr)
+    return data
+
+
+def _peak_rss_mb():
+    """Peak resident memory of this process and of its finished children, in MB."""
+    scale = 1 if sys.platform == "darwin" else 1024  # bytes on macOS, KiB on Linux
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * scale / 1e6
+
+
+def _folder_bytes(folder):
+    total = 0
+    for root, _, files in os.walk(folder):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def run_case(case, data, scratch, args):
+    """Run one case and return its measurements (without peak RSS)."""
+    from dataprep.video_extraction import extract_frames, kmeans_frame_selection
+
+    shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(scratch)
+    videos_dir = os.path.join(data, "videos")
+
+    if case.startswith("extract_"):
+        start = time.perf_counter()
+        stats = extract_frames(videos_dir, scratch, frame_number=args.extract_frames, method=case[len("extract_"):],
+                               seed=args.seed, workers=args.workers, decode_backend=args.decode_backend)
+        seconds = time.perf_counter() - start
+        written = sum(s["frames_written"] for s in stats)
+        return {"seconds": seconds, "frames_per_s": sum(s["decoded"] for s in stats) / seconds,
+                "files_per_s": written / seconds,
+                "mb_per_s": sum(s["bytes_written"] for s in stats) / 1e6 / seconds,
+                "frames_decoded": sum(s["decoded"] for s in stats), "frames_written": written,
+                "decoded_exact": all(s["decoded_exact"] for s in stats)}
+
+    if case == "kmeans_frame_selection":
+        from dataprep.video_reader import open_video
+
+        video = sorted(f for f in os.listdir(videos_dir) if f.endswith((".mp4", ".avi")))[0]
+        with open_video(os.path.join(videos_dir, video), args.decode_backend) as reader:
+            total = reader.frame_count
+            start = time.perf_counter()
+            kmeans_frame_selection(reader, args.extract_frames, show_progress=False)
+            seconds = time.perf_counter() - start
+        return {"seconds": seconds, "frames_per_s": total / seconds, "video_frames": total}
+
+    if case == "copy_images":
+        from dataprep.json2dlc import copy_images
+
+        start = time.perf_counter()
+        summary = copy_images(os.path.join(data, "frames"), scratch, os.path.join(data, "coco", "annotations.json"),
+                              "bench", transfer_mode=args.transfer_mode)
+        seconds = time.perf_counter() - start
+        files = sum(summary[key] for key in ("copy", "hardlink", "reflink", "symlink", "skipped"))
+        placed = summary["bytes_copied"] + summary["bytes_linked"]
+        return {"seconds": seconds, "files_per_s": files / seconds, "mb_per_s": placed / 1e6 / seconds,
+                "files": files, "bytes_copied": summary["bytes_copied"]}
+
+    if case == "prepare_yolo_dataset":
+        from dataprep.yolo_prep import prepare_yolo_dataset
+
+        shutil.copy(os.path.join(data, "export.zip"), scratch)
+        start = time.perf_counter()
+        prepare_yolo_dataset(scratch, os.path.join(data, "frames"), 80, transfer_mode=args.transfer_mode)
+        seconds = time.perf_counter() - start
+        export = os.path.join(scratch, "export")
+        files = sum(len(files) for _, _, files in os.walk(os.path.join(export, "images")))
+        files += sum(len(files) for _, _, files in os.walk(os.path.join(export, "labels")))
+        return {"seconds": seconds, "files_per_s": files / seconds,
+                "mb_per_s": _folder_bytes(os.path.join(export, "images")) / 1e6 / seconds, "files": files}
+
+    raise ValueError(f"Unknown case: {case}")
+
+
+def _case_process(case, data, scratch, args, queue):
+    # The pipeline prints progress; keep stdout for the JSON report
+    sys.stdout = sys.stderr
+    result = run_case(case, data, scratch, args)
+    result["peak_rss_mb"] = _peak_rss_mb()
+    queue.put(result)
+
+
+def run_isolated(case, data, args):
+    """Run a case `args.repeat` times, each in a fresh process, and keep the fastest run."""
+    context = multiprocessing.get_context("spawn")
+    best = None
+    for _ in range(args.repeat):
+        queue = context.Queue()
+        process = context.Process(target=_case_process,
+                                  args=(case, data, os.path.join(args.workdir, "scratch", case), args, queue))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"Benchmark case {case} failed with exit code {process.exitcode}")
+        result = queue.get()
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workdir", default="bench_work", help="Folder for the synthetic data and outputs.")
+    parser.add_argument("--output", help="JSON report file. Defaults to stdout.")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--videos", type=int, default=2, help="Number of synthetic videos.")
+    parser.add_argument("--frames", type=int, default=3000, help="Frames per video.")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--gop", type=int, default=12, help="Keyframe interval; 1 writes all-intra MJPG, others need PyAV except 12.")
+    parser.add_argument("--images", type=int, default=2000, help="Labeled images in the COCO and YOLO exports.")
+    parser.add_argument("--boxes", type=int, default=3, help="YOLO boxes per image.")
+    parser.add_argument("--extract-frames", type=int, default=50, help="Frames extracted per video.")
+    parser.add_argument("--workers", type=int, default=1, help="Processes of extract_frames.")
+    parser.add_argument("--decode-backend", default="opencv", choices=("auto", "opencv", "pyav"),
+                        help="Decode backend of the extraction and K-means cases.")
+    parser.add_argument("--transfer-mode", default="auto", help="Transfer mode of copy_images and the YOLO prep.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case; the fastest is reported.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data = prepare_data(args)
+    results = {}
+    for case in args.cases:
+        results[case] = run_isolated(case, data, args)
+        print(f"{case}: {results[case]['seconds']:.2f}s, peak RSS {results[case]['peak_rss_mb']:.0f} MB",
+              file=sys.stderr)
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "cases")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
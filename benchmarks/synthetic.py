@@ -0,0 +1,157 @@
+"""
+Synthetic inputs for the benchmarks: videos, frame folders, COCO keypoint exports and CVAT-style
+YOLO ZIPs. Everything is generated from a seed, so two runs with the same settings measure the
+same data.
+"""
+import os
+import json
+import importlib.util
+import zipfile
+import numpy as np
+
+BODYPARTS = ["nose", "left_ear", "right_ear", "neck", "tail_base", "tail_tip"]
+
+
+def make_video(path, frames=3000, width=640, height=480, fps=30, gop=12, scene_length=300, seed=0):
+    """
+    Write a video of bright blobs moving over a textured background that changes every `scene_length`
+    frames, so the motion and K-means selections have structure to find.
+
+    `gop` is the keyframe interval. 1 writes an all-intra MJPG AVI with OpenCV. Other values write MPEG-4
+    Part 2 without B-frames through PyAV, which sets the interval exactly; the keyframes of the written
+    file are checked against it. OpenCV's writer ignores the requested interval, so without PyAV only
+    FFmpeg's default of 12 can be written.
+
+    Returns:
+        str: Path of the video (the extension is replaced by '.avi' when `gop` is 1).
+    """
+    import cv2
+
+    if gop == 1:
+        path = os.path.splitext(path)[0] + ".avi"
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+        if not writer.isOpened():
+            raise IOError(f"Cannot open a video writer for {path}")
+        write, close = writer.write, writer.release
+    elif importlib.util.find_spec("av") is not None:
+        import av
+
+        container = av.open(path, "w")
+        stream = container.add_stream("mpeg4", rate=fps)
+        stream.width, stream.height, stream.pix_fmt = width, height, "yuv420p"
+        # The bit rate OpenCV's writer picks for this codec, so both paths give comparable files
+        stream.bit_rate = int(fps * width * height)
+        stream.codec_context.gop_size = int(gop)
+        stream.codec_context.max_b_frames = 0
+
+        def write(frame):
+            container.mux(stream.encode(av.VideoFrame.from_ndarray(frame, format="bgr24")))
+
+        def close():
+            container.mux(stream.encode())
+            container.close()
+    elif gop == 12:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+        if not writer.isOpened():
+            raise IOError(f"Cannot open a video writer for {path}")
+        write, close = writer.write, writer.release
+    else:
+        raise ImportError(f"Writing a keyframe interval of {gop} requires PyAV (pip install av)")
+
+    rng = np.random.default_rng(seed)
+    # A few noise images, cycled, keep generation cheap at high resolutions
+    noise = [rng.integers(0, 12, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+    yy, xx = np.mgrid[0:height, 0:width]
+    blobs = rng.uniform(0, 1, (4, 4))  # x, y, vx, vy as fractions of the frame
+    background = None
+    for i in range(frames):
+        if i % scene_length == 0:
+            phase = rng.uniform(0, 2 * np.pi, 3)
+            background = np.stack([(60 + 50 * np.sin(xx / (20 + 10 * c) + phase[c]) * np.cos(yy / 30)).astype(np.uint8)
+                                   for c in range(3)], axis=-1)
+        frame = background + noise[i % len(noise)]
+        for x, y, vx, vy in blobs:
+            cx = int(width * ((x + vx * i / 200) % 1))
+            cy = int(height * ((y + vy * i / 300) % 1))
+            cv2.circle(frame, (cx, cy), max(4, width // 40), (230, 230, 230), -1)
+        write(frame)
+    close()
+
+    if gop != 1 and importlib.util.find_spec("av") is not None:
+        keyframes = keyframe_indices(path)
+        if keyframes != list(range(0, frames, gop)):
+            raise RuntimeError(f"{path} has keyframes at {keyframes[:5]}..., not every {gop} frames")
+    return path
+
+
+def keyframe_indices(path):
+    """Indices of the keyframes of a video without B-frames, read from its packets (requires PyAV)."""
+    import av
+
+    with av.open(path) as container:
+        packets = [packet for packet in container.demux(container.streams.video[0]) if packet.size]
+    return [i for i, packet in enumerate(packets) if packet.is_keyframe]
+
+
+def frame_names(videos, frames_per_video, step=5):
+    """Frame file names in the `extract_frames` pattern: '<video>_img0005.png', ..."""
+    return [f"{video}_img{i * step:04d}.png" for video in videos for i in range(frames_per_video)]
+
+
+def make_frames(folder, names, width=640, height=480, seed=0):
+    """
+    Write one PNG per name. A few distinct images are encoded once and their bytes reused, so the
+    files have realistic sizes without paying the encoder per file.
+
+    Returns:
+        int: Total bytes written.
+    """
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    templates = []
+    for _ in range(4):
+        image = rng.integers(0, 40, (height, width, 3), dtype=np.uint8) + 100
+        templates.append(cv2.imencode(".png", image)[1].tobytes())
+    total = 0
+    for k, name in enumerate(names):
+        data = templates[k % len(templates)]
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(data)
+        total += len(data)
+    return total
+
+
+def make_coco(path, names, width=640, height=480, bodyparts=BODYPARTS, seed=0):
+    """Write a COCO keypoints export (one animal per image) like CVAT's 'COCO Keypoints 1.0'."""
+    rng = np.random.default_rng(seed)
+    images = [{"id": k + 1, "file_name": name, "width": width, "height": height} for k, name in enumerate(names)]
+    annotations = []
+    for image in images:
+        points = rng.uniform([0, 0], [width, height], (len(bodyparts), 2))
+        visibility = rng.choice([0, 2], len(bodyparts), p=[0.1, 0.9])
+        keypoints = np.column_stack([points, visibility]).ravel().tolist()
+        x0, y0 = points.min(axis=0)
+        x1, y1 = points.max(axis=0)
+        annotations.append({"id": image["id"], "image_id": image["id"], "category_id": 1,
+                            "keypoints": keypoints, "num_keypoints": int((visibility > 0).sum()),
+                            "bbox": [x0, y0, x1 - x0, y1 - y0], "area": float((x1 - x0) * (y1 - y0)),
+                            "iscrowd": 0, "segmentation": [], "attributes": {"occluded": False}})
+    categories = [{"id": 1, "name": "mouse", "supercategory": "", "keypoints": list(bodyparts),
+                   "skeleton": [[k + 1, k + 2] for k in range(len(bodyparts) - 1)]}]
+    with open(path, 'w') as f:
+        json.dump({"licenses": [], "info": {}, "categories": categories, "images": images,
+                   "annotations": annotations}, f)
+
+
+def make_yolo_zip(path, names, boxes_per_image=3, seed=0):
+    """Write a CVAT 'YOLO 1.1'-style export: data.yaml, train.txt and one label file per image."""
+    rng = np.random.default_rng(seed)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("data.yaml", "names:\n  0: mouse\npath: .\ntrain: train.txt\n")
+        archive.writestr("train.txt", "".join(f"data/images/train/{name}\n" for name in names))
+        for name in names:
+            boxes = rng.uniform(0.05, 0.95, (boxes_per_image, 4)) * [1, 1, 0.2, 0.2]
+            lines = "".join(f"0 {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n" for x, y, w, h in boxes)
+            archive.writestr(f"labels/train/{os.path.splitext(name)[0]}.txt", lines)
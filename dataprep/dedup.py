@@ -0,0 +1,154 @@
+import os
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def frame_hash(frame):
+    """
+    Compute the 64-bit difference hash (dHash) of a frame.
+
+    The frame is reduced to a 9 x 8 grayscale thumbnail and each bit records whether a pixel is
+    brighter than its left neighbour, so the hash survives compression noise and small shifts.
+
+    Args:
+        frame (np.ndarray): BGR or grayscale image.
+
+    Returns:
+        np.uint64: The hash.
+    """
+    import cv2
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return np.packbits(bits).view('>u8').astype(np.uint64)[0]
+
+
+def hamming_distances(hashes, value):
+    """
+    Hamming distances between every hash of a uint64 array and one hash, with a vectorized popcount.
+    """
+    x = np.bitwise_xor(hashes, np.uint64(value))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    # SWAR popcount for NumPy < 2.0
+    x = x - ((x >> np.uint64(1)) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return (x * _H01) >> np.uint64(56)
+
+
+class HashIndex:
+    """
+    Perceptual hashes of kept frames, stored as a growing NumPy uint64 array.
+
+    Args:
+        path (str, optional): .npy file the index is loaded from (if it exists) and saved to.
+        threshold (int): Frames within this Hamming distance of a kept frame are duplicates.
+    """
+
+    def __init__(self, path=None, threshold=4):
+        self.path = path
+        self.threshold = threshold
+        self._hashes = np.empty(1024, dtype=np.uint64)
+        self._size = 0
+        if path and os.path.exists(path):
+            self.extend(np.load(path))
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def hashes(self):
+        """The kept hashes, as a read-only view."""
+        view = self._hashes[:self._size]
+        view.flags.writeable = False
+        return view
+
+    def is_duplicate(self, value):
+        """Whether `value` is within `threshold` bits of any hash in the index."""
+        if self._size == 0:
+            return False
+        return bool(hamming_distances(self._hashes[:self._size], value).min() <= self.threshold)
+
+    def add(self, value):
+        self.extend(np.array([value], dtype=np.uint64))
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=np.uint64)
+        needed = self._size + len(values)
+        if needed > len(self._hashes):
+            grown = np.empty(max(needed, 2 * len(self._hashes)), dtype=np.uint64)
+            grown[:self._size] = self._hashes[:self._size]
+            self._hashes = grown
+        self._hashes[self._size:needed] = values
+        self._size = needed
+
+    def keep(self, frame):
+        """
+        Add the hash of `frame` unless it duplicates a kept frame.
+
+        Returns:
+            bool: True if the frame is new and should be kept.
+        """
+        value = frame_hash(frame)
+        if self.is_duplicate(value):
+            return False
+        self.add(value)
+        return True
+
+    def save(self, path=None):
+        path = path or self.path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        np.save(path, self._hashes[:self._size])
+
+
+def dedup_folder(folder, threshold=4, index_path=None, remove=False):
+    """
+    Find near-duplicate images in an existing folder, e.g. 'total_video_frames'.
+
+    Images are visited in sorted order; an image is a duplicate if its hash is within `threshold`
+    bits of an image kept before it (or of a hash already in the index at `index_path`).
+
+    Args:
+        folder (str): Folder containing the images.
+        threshold (int): Maximum Hamming distance between near-duplicate hashes.
+        index_path (str, optional): .npy index of previously kept frames; updated with the kept images.
+        remove (bool): Delete the duplicates from the folder.
+
+    Returns:
+        List[str]: Paths of the duplicate images.
+    """
+    import cv2
+    from tqdm import tqdm
+
+    index = HashIndex(index_path, threshold)
+    names = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+    duplicates = []
+    for name in tqdm(names, desc="Hashing frames"):
+        path = os.path.join(folder, name)
+        frame = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if frame is None:
+            print(f"Warning: Could not read image {path}")
+            continue
+        if not index.keep(frame):
+            duplicates.append(path)
+
+    if remove:
+        for path in duplicates:
+            os.remove(path)
+    if index_path:
+        index.save()
+
+    print(f"Found {len(duplicates)} near-duplicate images out of {len(names)} in '{folder}'"
+          + (" and removed them." if remove else "."))
+    return duplicates
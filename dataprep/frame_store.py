@@ -0,0 +1,185 @@
+import io
+import os
+import json
+import numpy as np
+
+STORE_SUFFIX = ".frames"
+
+
+class FrameStore:
+    """
+    Append the selected frames of one video to a preallocated uint8 array on disk.
+
+    The frames go into '<video>.frames.npy', a `np.lib.format.open_memmap` file of shape
+    (capacity, height, width, channels), created on the first frame. `close` writes the index
+    '<video>.frames.json' with the frame index and byte offset of every row, and shrinks the array
+    to the rows actually written (e.g. after deduplication).
+
+    Args:
+        folder (str): Folder of the store files.
+        video_name (str): Name of the video, used for the file names.
+        capacity (int): Maximum number of frames, usually the number of selected frames.
+    """
+
+    def __init__(self, folder, video_name, capacity):
+        self.folder = folder
+        self.video_name = video_name
+        self.capacity = capacity
+        self.frame_indices = []
+        self._array = None
+        self._frame_bytes = 0
+        os.makedirs(folder, exist_ok=True)
+
+    @property
+    def array_path(self):
+        return os.path.join(self.folder, self.video_name + STORE_SUFFIX + ".npy")
+
+    @property
+    def index_path(self):
+        return os.path.join(self.folder, self.video_name + STORE_SUFFIX + ".json")
+
+    def __len__(self):
+        return len(self.frame_indices)
+
+    @property
+    def frame_bytes(self):
+        """Bytes per stored frame (0 before the first frame)."""
+        return self._frame_bytes
+
+    def append(self, frame_index, frame):
+        """Copy a decoded frame into the next row."""
+        if self._array is None:
+            self._array = np.lib.format.open_memmap(self.array_path, mode='w+', dtype=np.uint8,
+                                                    shape=(self.capacity,) + frame.shape)
+            self._frame_bytes = frame.nbytes
+        if len(self.frame_indices) >= self.capacity:
+            raise ValueError(f"Frame store of {self.video_name} is full ({self.capacity} frames)")
+        self._array[len(self.frame_indices)] = frame
+        self.frame_indices.append(int(frame_index))
+
+    def close(self):
+        """Flush the frames, trim unused rows and write the index."""
+        if self._array is None:
+            return
+        shape = self._array.shape
+        data_offset = self._array.offset
+        self._array.flush()
+        del self._array
+        self._array = None
+
+        count = len(self.frame_indices)
+        frame_bytes = int(np.prod(shape[1:]))
+        if count < shape[0]:
+            _shrink_npy(self.array_path, (count,) + shape[1:], data_offset, frame_bytes)
+
+        index = {
+            "video": self.video_name,
+            "file": os.path.basename(self.array_path),
+            "shape": [count] + list(shape[1:]),
+            "data_offset": data_offset,
+            "frame_bytes": frame_bytes,
+            "frames": self.frame_indices,
+            "offsets": [data_offset + row * frame_bytes for row in range(count)],
+        }
+        with open(self.index_path + ".tmp", 'w') as f:
+            json.dump(index, f)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _shrink_npy(path, shape, data_offset, frame_bytes):
+    """Rewrite the header of a uint8 .npy file for fewer rows and truncate the unused ones."""
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {'descr': '|u1', 'fortran_order': False, 'shape': shape})
+    header = header.getvalue()
+    if len(header) != data_offset:
+        # The padded header only changes length for huge shape changes; keep the rows then
+        return
+    with open(path, 'r+b') as f:
+        f.write(header)
+        f.truncate(data_offset + shape[0] * frame_bytes)
+
+
+class FrameStoreReader:
+    """
+    Read the frame stores written by `FrameStore` in a folder.
+
+    `frames` returns a read-only memmap, so slicing a batch of rows reads only those rows and copies
+    nothing until the data is used.
+
+    Args:
+        folder (str): Folder of the store files.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._index = {}
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.name.endswith(STORE_SUFFIX + ".json"):
+                    with open(entry.path, 'r') as f:
+                        index = json.load(f)
+                    self._index[index["video"]] = index
+        self._arrays = {}
+
+    @property
+    def videos(self):
+        return sorted(self._index)
+
+    def frame_indices(self, video):
+        """Original frame index of every row of a video's store."""
+        return np.asarray(self._index[video]["frames"], dtype=np.int64)
+
+    def frames(self, video):
+        """Frames of a video as a read-only (frames, height, width, channels) memmap."""
+        if video not in self._arrays:
+            index = self._index[video]
+            array = np.load(os.path.join(self.folder, index["file"]), mmap_mode='r')
+            self._arrays[video] = array[:index["shape"][0]]
+        return self._arrays[video]
+
+    def get(self, video, frame_index):
+        """The frame with original index `frame_index`. Raises KeyError if it was not stored."""
+        indices = self.frame_indices(video)
+        row = int(np.searchsorted(indices, frame_index))
+        if row >= len(indices) or indices[row] != frame_index:
+            raise KeyError(f"Frame {frame_index} of {video} is not in the store")
+        return self.frames(video)[row]
+
+    def iter_batches(self, video, batch_size=64):
+        """Yield (frame indices, frames) in batches of rows; the frames are memmap views."""
+        indices = self.frame_indices(video)
+        frames = self.frames(video)
+        for start in range(0, len(indices), batch_size):
+            yield indices[start:start + batch_size], frames[start:start + batch_size]
+
+    def export(self, output_folder, videos=None, ext=".png", params=None):
+        """
+        Write stored frames as images named like `extract_frames` output ('<video>_img0042.png').
+
+        Args:
+            output_folder (str): Folder the images are written to.
+            videos (List[str], optional): Videos to export. Defaults to all.
+            ext (str): Image extension, e.g. ".png" or ".jpg".
+            params (List[int], optional): `cv2.imwrite` parameters, e.g. [cv2.IMWRITE_JPEG_QUALITY, 95].
+
+        Returns:
+            List[str]: Paths of the written images.
+        """
+        import cv2
+
+        os.makedirs(output_folder, exist_ok=True)
+        paths = []
+        for video in videos or self.videos:
+            for indices, frames in self.iter_batches(video):
+                for i, frame in zip(indices, frames):
+                    path = os.path.join(output_folder, f"{video}_img{i:04d}{ext}")
+                    if not cv2.imwrite(path, frame, params or []):
+                        raise IOError(f"Failed to write frame to {path}")
+                    paths.append(path)
+        return paths
@@ -0,0 +1,165 @@
+import os
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+LINK_MODES = ("hardlink", "symlink", "copy")
+
+# Image format name -> file extension
+IMAGE_FORMATS = {"png": ".png", "jpeg": ".jpg", "jpg": ".jpg", "webp": ".webp"}
+
+
+def encode_params(image_format="png", quality=None, png_compression=None):
+    """
+    File extension and `cv2.imencode` parameters of an image format.
+
+    Args:
+        image_format (str): "png", "jpeg" (or "jpg") or "webp".
+        quality (int, optional): JPEG/WebP quality (1-100). None keeps the OpenCV default (95).
+            WebP above 100 is lossless.
+        png_compression (int, optional): PNG zlib level (0-9). None keeps the OpenCV default (1).
+            Lower levels encode faster and write larger files.
+
+    Returns:
+        Tuple[str, List[int]]: The extension and the encoder parameters.
+    """
+    import cv2
+
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}. Choose from {tuple(IMAGE_FORMATS)}.")
+    ext = IMAGE_FORMATS[image_format]
+    params = []
+    if ext == ".png" and png_compression is not None:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)]
+    elif ext == ".jpg" and quality is not None:
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    elif ext == ".webp" and quality is not None:
+        params = [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    return ext, params
+
+
+def link_or_copy(src, dst, link="hardlink"):
+    """
+    Place a second copy of a file, as a link when the filesystem allows it.
+
+    Args:
+        src (str): Existing file.
+        dst (str): Path of the copy. An existing file at this path is replaced.
+        link (str): "hardlink", "symlink" or "copy". Links fall back to a real copy when they
+            cannot be created (e.g. across devices, or symlinks without privileges on Windows).
+
+    Returns:
+        str: The mode actually used.
+    """
+    if link not in LINK_MODES:
+        raise ValueError(f"Unknown link mode: {link}. Choose from {LINK_MODES}.")
+
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if link == "hardlink":
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    elif link == "symlink":
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return "symlink"
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
+class FrameWriter:
+    """
+    Encode and write frames on a pool of background threads.
+
+    `cv2.imencode` releases the GIL, so encoding overlaps with decoding in the caller. At most
+    `max_pending` frames are held in memory: `submit` blocks until a slot frees up.
+
+    Each frame is written to a temporary file and renamed into place, so a crash never leaves a
+    partly written image under the final name. The `key` of every frame written so far is appended
+    to `completed`.
+
+    `stats` counts the frames written, the copies per link mode, "encode_seconds" (encoder time
+    summed over the threads) and "bytes" (size of the encoded frames, copies not included).
+
+    Use as a context manager; leaving the block waits for all pending writes and re-raises the
+    first error from a writer thread.
+
+    Args:
+        num_threads (int): Number of encoder threads.
+        max_pending (int): Maximum number of frames queued or being encoded.
+        link (str): How extra copies of a frame are placed, see `link_or_copy`.
+        image_format (str): "png", "jpeg" or "webp", see `encode_params`. Paths passed to `submit`
+            should end with `ext`.
+        quality (int, optional): JPEG/WebP quality.
+        png_compression (int, optional): PNG compression level.
+    """
+
+    def __init__(self, num_threads=4, max_pending=32, link="hardlink", image_format="png", quality=None,
+                 png_compression=None):
+        if link not in LINK_MODES:
+            raise ValueError(f"Unknown link mode: {link}. Choose from {LINK_MODES}.")
+        self.link = link
+        self.ext, self.params = encode_params(image_format, quality, png_compression)
+        self.stats = {"written": 0, **{mode: 0 for mode in LINK_MODES}, "encode_seconds": 0.0, "bytes": 0}
+        self._pool = ThreadPoolExecutor(max_workers=num_threads)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._futures = []
+        self.completed = []
+
+    def submit(self, frame, path, copies=(), key=None):
+        """
+        Queue a frame to be encoded once to `path` and linked (or copied) to each of `copies`.
+        `key` (e.g. the frame index) is added to `completed` once all files are in place.
+        """
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(self._write, frame, path, tuple(copies), key)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _write(self, frame, path, copies, key=None):
+        import cv2
+
+        start = time.perf_counter()
+        ok, data = cv2.imencode(self.ext, frame, self.params)
+        encode_seconds = time.perf_counter() - start
+        if not ok:
+            raise IOError(f"Could not encode frame for {path}")
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        modes = [link_or_copy(path, copy, self.link) for copy in copies]
+        with self._lock:
+            if key is not None:
+                self.completed.append(key)
+            self.stats["written"] += 1
+            self.stats["encode_seconds"] += encode_seconds
+            self.stats["bytes"] += data.nbytes
+            for mode in modes:
+                self.stats[mode] += 1
+
+    def close(self):
+        """Wait for all pending writes and raise the first error, if any."""
+        self._pool.shutdown(wait=True)
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.shutdown(wait=True)
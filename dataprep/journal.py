@@ -0,0 +1,82 @@
+import os
+import json
+import time
+import hashlib
+
+JOURNAL_FOLDER = ".extraction_journal"
+
+
+def journal_key(video_path, options):
+    """
+    Hash of a video's identity (path, size, mtime) and of the options that decide which frames are
+    selected and how they are written. The frame budget is not part of it, so a run that only changes
+    the budget can reuse the frames already written.
+    """
+    stat = os.stat(video_path)
+    identity = [os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns, options]
+    return hashlib.sha1(json.dumps(identity, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ExtractionJournal:
+    """
+    On-disk record of the extraction of one video: the options hash, the frame budget, the selected
+    frame indices and the indices already completed (written or skipped as duplicates).
+
+    The journal is rewritten atomically (temporary file, then rename) at most every `interval`
+    seconds while frames complete, so after a crash it lists a subset of the frames actually on disk.
+
+    Args:
+        path (str): Journal file, usually '<output>/.extraction_journal/<video>.json'.
+        interval (float): Minimum number of seconds between two writes of `update`.
+    """
+
+    def __init__(self, path, interval=2.0):
+        self.path = path
+        self.interval = interval
+        self.key = None
+        self.budget = None
+        self.selected = []
+        self.completed = set()
+        self.done = False
+        self._last_save = 0.0
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                self.key = data["key"]
+                self.budget = data["budget"]
+                self.selected = data["selected"]
+                self.completed = set(data["completed"])
+                self.done = data["done"]
+            except (OSError, ValueError, KeyError):
+                print(f"Warning: Ignoring unreadable extraction journal {path}")
+
+    def start(self, key, budget, selected, completed=()):
+        """Record a new selection (keeping the given completed frames) and save it."""
+        self.key = key
+        self.budget = budget
+        self.selected = [int(i) for i in selected]
+        self.completed = set(int(i) for i in completed)
+        self.done = False
+        self.save()
+
+    def update(self, completed):
+        """Add completed frame indices and save if the last save is older than `interval`."""
+        self.completed.update(int(i) for i in completed)
+        if time.monotonic() - self._last_save >= self.interval:
+            self.save()
+
+    def finish(self):
+        self.done = True
+        self.save()
+
+    def save(self):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        data = {"key": self.key, "budget": self.budget, "selected": self.selected,
+                "completed": sorted(self.completed), "done": self.done}
+        with open(self.path + ".tmp", 'w') as f:
+            json.dump(data, f)
+        os.replace(self.path + ".tmp", self.path)
+        self._last_save = time.monotonic()
@@ -1,14 +1,21 @@
 import warnings
 from pathlib import Path
-import deeplabcut
-from deeplabcut import DEBUG
-from deeplabcut.utils.auxfun_videos import VideoReader
 import json
 import os
 import shutil
-import csv
+import filecmp
+import hashlib
+from collections import defaultdict, deque
+from dataprep.metrics import current_stage, staged
+from dataprep.project_manifest import MANIFEST_FILE, LabeledDataManifest
+from dataprep.shards import SHARD_SIZE, ShardWriter
+from dataprep.transfer import format_summary, transfer_files
+from dataprep.video_meta import METADATA_FILE, probe_videos
 
+FRAME_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
 
+
+@staged("create_new_project")
 def create_new_project(
     project,
     experimenter,
@@ -18,7 +25,15 @@ def create_new_project(
     working_directory=None,
     copy_videos=False,
     multianimal = False,
-    videotype=""
+    videotype="",
+    stream_json=False,
+    probe_workers=8,
+    transfer_mode="auto",
+    transfer_workers=8,
+    shards=False,
+    shard_size=SHARD_SIZE,
+    update=False,
+    metadata_cache=None
 ):
     r"""Create the necessary folders and files for a new project.
 
@@ -54,6 +69,41 @@ def create_new_project(
     multianimal: bool, optional. Default: False.
         For creating a multi-animal project (introduced in DLC 2.2)
 
+    stream_json: bool, optional. Default: False.
+        Parse the annotation file incrementally and keep only the fields the label
+        tables need (see ``CocoAnnotations.load``), for very large exports.
+
+    probe_workers: int, optional. Default: 8.
+        Number of threads reading video metadata. Results are cached in
+        ``metadata_cache``, so unchanged videos are not reopened.
+
+    transfer_mode: string, optional. Default: "auto".
+        How videos (with ``copy_videos``) and labeled frames are copied: "auto" tries a
+        hardlink, then a reflink, then copies. See ``dataprep.transfer.transfer_file``.
+
+    transfer_workers: int, optional. Default: 8.
+        Number of concurrent file transfers.
+
+    shards: bool, optional. Default: False.
+        Write the labeled frames into tar shards in ``labeled-data-shards`` instead of
+        ``labeled-data`` (see ``copy_images``). The shard index is recorded in the config
+        as ``labeled_data_shards``. DeepLabCut reads frames from ``labeled-data``, so the
+        training dataset is not created in this mode.
+
+    shard_size: int, optional. Default: 1 GiB.
+        Target maximum size of a shard in bytes.
+
+    update: bool, optional. Default: False.
+        If the project already exists, add the new labeled frames and videos to it with
+        ``update_project`` instead of returning. The project name contains the creation
+        date, so for a project created on another day call ``update_project`` with its
+        config.yaml.
+
+    metadata_cache: string, optional. Default: None.
+        File caching the video metadata. The default is ``.video_metadata.json`` in
+        ``videos_dir``; point it elsewhere (e.g. into the project) when that folder is
+        read-only or shared.
+
     Returns
     -------
     str
@@ -61,16 +111,11 @@ def create_new_project(
 
     """
     from datetime import datetime as dt
+    import deeplabcut
+    from deeplabcut import DEBUG
     from deeplabcut.utils import auxiliaryfunctions
 
-    json_files = [f for f in os.listdir(json_folder) if f.endswith('.json')]
-    if json_files:
-        json_file = os.path.join(json_folder, json_files[0])
-        print(f"Using JSON file: {json_file}")
-    else:
-        print("No JSON file found in the specified folder.")
-
-    videotypes = (".mp4", ".avi", ".mov", ".mkv")
+    json_file = find_json_file(json_folder)
 
     months_3letter = {
         1: "Jan", 2: "Feb", 3: "Mar", 4: "Apr", 5: "May", 6: "Jun",
@@ -89,6 +134,11 @@ def create_new_project(
     project_path = wd / project_name
 
     if not DEBUG and project_path.exists():
+        if update:
+            return update_project(os.path.join(str(project_path), "config.yaml"), json_folder, videos_dir,
+                                  frames_dir, copy_videos=copy_videos, stream_json=stream_json,
+                                  probe_workers=probe_workers, transfer_mode=transfer_mode,
+                                  transfer_workers=transfer_workers, metadata_cache=metadata_cache)
         print(f'Project "{project_path}" already exists!')
         return os.path.join(str(project_path), "config.yaml")
     video_path = project_path / "videos"
@@ -97,44 +147,11 @@ def create_new_project(
         p.mkdir(parents=True, exist_ok=DEBUG)
         print(f'Created "{p}"')
 
-    videos = []
-    videos_dir = Path(videos_dir).resolve()
-    if videos_dir.is_dir():
-        for ext in videotypes:
-            videos.extend(videos_dir.rglob(f"*{ext}"))
-        if not videos:
-            print(f"No videos found in {videos_dir} with types {videotypes}.")
-            return
-    else:
-        print(f"{videos_dir} is not a valid directory.")
+    video_sets = link_videos(videos_dir, video_path, copy_videos, transfer_mode, transfer_workers, probe_workers,
+                             metadata_cache)
+    if video_sets is None:
         return
 
-
-    destinations = [video_path / vp.name for vp in videos]
-    if copy_videos:
-        print("Copying the videos")
-        for src, dst in zip(videos, destinations):
-            shutil.copy(src, dst)
-    else:
-        print("Attempting to create symbolic links for videos...")
-        for src, dst in zip(videos, destinations):
-            try:
-                os.symlink(src, dst)
-                print(f"Created symbolic link for {src} to {dst}")
-            except OSError:
-                shutil.copy(src, dst)
-                print(f"Copied {src} to {dst}")
-
-    video_sets = {}
-    for video in destinations:
-        try:
-            video = str(video.resolve())
-            vid = VideoReader(video)
-            video_sets[video] = {"crop": ", ".join(map(str, vid.get_bbox()))}
-        except IOError:
-            warnings.warn(f"Cannot open video file {video}! Skipping...")
-            os.remove(video)
-
     if not video_sets:
         shutil.rmtree(project_path, ignore_errors=True)
         warnings.warn("No valid videos found. Project was not created.")
@@ -142,12 +159,15 @@ def create_new_project(
 
 
 
+    # Parse the annotation file once for the config and the label tables
+    coco = CocoAnnotations.load(json_file, streaming=stream_json)
+
     if multianimal:  # parameters specific to multianimal project
         print('No multianimal in this project')
     else:
         cfg_file, ruamelFile = auxiliaryfunctions.create_config_template()
         cfg_file["multianimalproject"] = False
-        cfg_file["bodyparts"], cfg_file["skeleton"] = json2dlc_config_single(json_file)
+        cfg_file["bodyparts"], cfg_file["skeleton"] = json2dlc_config_single(coco)
         cfg_file["default_augmenter"] = "default"
         cfg_file["default_net_type"] = "resnet_50"
 
@@ -178,6 +198,9 @@ def create_new_project(
     cfg_file["dotsize"] = 2  # for plots size of dots
     cfg_file["alphavalue"] = 0.7  # for plots transparency of markers
     cfg_file["colormap"] = "rainbow"  # for plots type of colormap
+    if shards:
+        cfg_file["labeled_data_shards"] = os.path.join(str(project_path), "labeled-data-shards",
+                                                       "labeled-data_index.json")
 
     projconfigfile = os.path.join(str(project_path), "config.yaml")
     # Write dictionary to yaml  config file
@@ -189,18 +212,305 @@ def create_new_project(
         % (project_name, str(wd))
     )
 
-    copy_images(frames_dir, project_path, json_file, experimenter)
-    deeplabcut.convertcsv2h5(projconfigfile, userfeedback= False)
-    deeplabcut.create_training_dataset(projconfigfile)
+    copy_images(frames_dir, project_path, coco, experimenter, transfer_mode=transfer_mode,
+                transfer_workers=transfer_workers, shards=shards, shard_size=shard_size)
+    if shards:
+        print("Labeled frames are in shards; unpack them into labeled-data before creating the training dataset.")
+    else:
+        deeplabcut.create_training_dataset(projconfigfile)
 
     return projconfigfile
 
 
-def json2dlc_config_single(json_file):
-    with open(json_file, 'r') as f:
-        data = json.load(f)
+@staged("update_project")
+def update_project(
+    config,
+    json_folder,
+    videos_dir,
+    frames_dir,
+    copy_videos=False,
+    stream_json=False,
+    probe_workers=8,
+    transfer_mode="auto",
+    transfer_workers=8,
+    metadata_cache=None
+):
+    r"""Add new labeled frames and videos to an existing project.
+
+    The COCO export is compared with what earlier runs placed in ``labeled-data`` (see
+    ``dataprep.project_manifest``): only new frames and frames whose content changed are
+    transferred, and only the label tables of videos whose labels changed are rewritten,
+    keeping the rows of frames labeled in earlier exports. New videos are linked and added
+    to ``video_sets``; the other entries are left as they are. The training dataset is
+    created again only if a label table changed.
+
+    Parameters
+    ----------
+    config : string
+        Full path of the config.yaml file of the project.
+
+    json_folder: string
+        The path of the folder (contains .json file)
+
+    videos_dir : string
+        Folder of the videos. Videos already in the project are skipped.
 
-    catalogue = data['categories']
+    frames_dir : string
+        Root folder of the extracted frames.
+
+    copy_videos, stream_json, probe_workers, transfer_mode, transfer_workers, metadata_cache:
+        As in ``create_new_project``.
+
+    Returns
+    -------
+    str
+        Path to the project configuration file.
+
+    """
+    import deeplabcut
+    from deeplabcut.utils import auxiliaryfunctions
+
+    cfg = auxiliaryfunctions.read_config(config)
+    project_path = os.path.dirname(os.path.abspath(config))
+    json_file = find_json_file(json_folder)
+
+    video_sets = link_videos(videos_dir, Path(project_path) / "videos", copy_videos, transfer_mode,
+                             transfer_workers, probe_workers, metadata_cache) or {}
+    changed = {video: entry for video, entry in video_sets.items() if cfg["video_sets"].get(video) != entry}
+    if changed:
+        cfg["video_sets"].update(changed)
+        auxiliaryfunctions.write_config(config, cfg)
+        print(f"Added or updated {len(changed)} videos in video_sets")
+
+    coco = CocoAnnotations.load(json_file, streaming=stream_json)
+    bodyparts, _ = json2dlc_config_single(coco)
+    if bodyparts != cfg["bodyparts"]:
+        warnings.warn(f"The bodyparts of {json_file} differ from those of the project: {bodyparts}")
+
+    summary = copy_images(frames_dir, project_path, coco, cfg["scorer"], transfer_mode=transfer_mode,
+                          transfer_workers=transfer_workers, update=True)
+    if summary["tables_written"]:
+        deeplabcut.create_training_dataset(config)
+    else:
+        print("No label table changed; the training dataset is left as it is.")
+
+    return config
+
+
+def find_json_file(json_folder):
+    """Path of the first .json file in `json_folder`, or None."""
+    json_files = [f for f in os.listdir(json_folder) if f.endswith('.json')]
+    if json_files:
+        json_file = os.path.join(json_folder, json_files[0])
+        print(f"Using JSON file: {json_file}")
+        return json_file
+    print("No JSON file found in the specified folder.")
+    return None
+
+
+def link_videos(videos_dir, video_path, copy_videos=False, transfer_mode="auto", transfer_workers=8,
+                probe_workers=8, metadata_cache=None):
+    """
+    Link (or copy) the videos found under `videos_dir` into the project's 'videos' folder and probe them.
+
+    Videos already in place with the same size and mtime are skipped, and probe results are cached next
+    to the sources, so only new or changed videos cost time. Unreadable videos are removed again.
+
+    Args:
+        videos_dir (str): Folder searched recursively for videos.
+        video_path (Path): The project's 'videos' folder.
+        copy_videos (bool): Copy the videos with `transfer_mode` instead of symlinking them.
+        transfer_mode (str): How videos are copied, see `dataprep.transfer.transfer_file`.
+        transfer_workers (int): Number of concurrent file transfers.
+        probe_workers (int): Number of threads reading video metadata.
+        metadata_cache (str, optional): Video metadata cache file. Defaults to `METADATA_FILE` in `videos_dir`.
+
+    Returns:
+        dict: `video_sets` entries ({video path: {"crop": "x1, x2, y1, y2"}}) of the readable videos, or
+        None if `videos_dir` holds no videos.
+    """
+    videotypes = (".mp4", ".avi", ".mov", ".mkv")
+
+    videos = []
+    videos_dir = Path(videos_dir).resolve()
+    if videos_dir.is_dir():
+        for ext in videotypes:
+            videos.extend(videos_dir.rglob(f"*{ext}"))
+        if not videos:
+            print(f"No videos found in {videos_dir} with types {videotypes}.")
+            return None
+    else:
+        print(f"{videos_dir} is not a valid directory.")
+        return None
+
+    destinations = [video_path / vp.name for vp in videos]
+    if copy_videos:
+        print("Copying the videos")
+        summary = transfer_files(zip(videos, destinations), transfer_mode, transfer_workers)
+    else:
+        print("Attempting to create symbolic links for videos...")
+        summary = transfer_files(zip(videos, destinations), "symlink", transfer_workers)
+    print(f"Videos: {format_summary(summary)}")
+
+    # Probe the source videos (cached next to them by path, size and mtime) on a thread pool
+    metadata = probe_videos([str(src) for src in videos], metadata_cache or os.path.join(videos_dir, METADATA_FILE),
+                            probe_workers)
+    video_sets = {}
+    for src, dst in zip(videos, destinations):
+        meta = metadata[str(src)]
+        if meta is None:
+            warnings.warn(f"Cannot open video file {src}! Skipping...")
+            os.remove(dst)
+            continue
+        video_sets[str(dst.resolve())] = {"crop": ", ".join(map(str, meta["bbox"]))}
+    current_stage().update(videos=len(videos), videos_valid=len(video_sets))
+    return video_sets
+
+
+class CocoAnnotations:
+    """
+    The categories, images and annotations of a COCO keypoints export, parsed once and shared
+    by `json2dlc_config_single`, `copy_images` and `write_label_tables`.
+    """
+
+    # Fields kept per entry in streaming mode; everything else (segmentation, bbox, attributes...) is dropped
+    IMAGE_FIELDS = ('id', 'file_name', 'width', 'height')
+    ANNOTATION_FIELDS = ('image_id', 'category_id', 'keypoints')
+
+    def __init__(self, categories, images, annotations):
+        self.categories = categories
+        self.images = images
+        self.annotations = annotations
+
+    @classmethod
+    def load(cls, js_file, streaming=False, chunk_size=1 << 20):
+        """
+        Parse a COCO JSON file. An already loaded `CocoAnnotations` is returned unchanged.
+
+        Args:
+            js_file (str or CocoAnnotations): Path of the JSON file.
+            streaming (bool): Read 'categories', 'images' and 'annotations' one entry at a time
+                (see `iter_json_arrays`) and keep only the fields used for DLC projects, instead of
+                building the whole document in memory.
+            chunk_size (int): Number of characters read at a time in streaming mode.
+
+        Returns:
+            CocoAnnotations: The parsed annotations.
+        """
+        if isinstance(js_file, cls):
+            return js_file
+
+        if not streaming:
+            with open(js_file, 'r') as f:
+                data = json.load(f)
+            return cls(data.get('categories', []), data.get('images', []), data.get('annotations', []))
+
+        sections = {'categories': [], 'images': [], 'annotations': []}
+        fields = {'images': cls.IMAGE_FIELDS, 'annotations': cls.ANNOTATION_FIELDS}
+        for key, item in iter_json_arrays(js_file, sections, chunk_size):
+            if key in fields:
+                item = {field: item[field] for field in fields[key] if field in item}
+            sections[key].append(item)
+        return cls(sections['categories'], sections['images'], sections['annotations'])
+
+
+def iter_json_arrays(js_file, keys, chunk_size=1 << 20):
+    """
+    Stream the elements of top-level arrays of a JSON object without loading the whole document.
+
+    The file is read in chunks and each array element is decoded on its own with
+    `json.JSONDecoder.raw_decode`, so memory holds one chunk plus the element being decoded.
+    Values under other keys are decoded and discarded (arrays element by element).
+
+    Args:
+        js_file (str): Path of a JSON file whose top level is an object.
+        keys (Iterable[str]): Top-level keys whose array elements are yielded.
+        chunk_size (int): Number of characters read at a time.
+
+    Yields:
+        Tuple[str, object]: The top-level key and one decoded element of its array.
+    """
+    keys = set(keys)
+    decoder = json.JSONDecoder()
+    whitespace = ' \t\n\r'
+    delimiters = whitespace + ',]}'
+
+    with open(js_file, 'r') as f:
+        buf = ''
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def peek():
+            # Next non-whitespace character, reading more input as needed
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in whitespace:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return buf[pos] if pos < len(buf) else ''
+                fill()
+
+        def decode():
+            # Decode the value at `pos`; a value that ends with the buffer may be truncated (e.g. a number)
+            nonlocal pos
+            peek()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # A number cut at its '.' or exponent decodes as a shorter number ('-0.' as -0), so it
+                    # is only complete when a delimiter follows it
+                    complete = end < len(buf) and (not isinstance(value, (int, float)) or buf[end] in delimiters)
+                    if complete or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        if peek() != '{':
+            raise ValueError(f"{js_file} does not contain a JSON object.")
+        pos += 1
+        while True:
+            char = peek()
+            if char == '}':
+                return
+            if char == ',':
+                pos += 1
+                continue
+            key = decode()
+            if peek() != ':':
+                raise ValueError(f"Malformed JSON in {js_file} after key '{key}'.")
+            pos += 1
+            if peek() != '[':
+                decode()
+                continue
+            pos += 1
+            while True:
+                char = peek()
+                if char == ']':
+                    pos += 1
+                    break
+                if char == ',':
+                    pos += 1
+                    continue
+                if not char:
+                    raise ValueError(f"Unexpected end of {js_file} inside '{key}'.")
+                item = decode()
+                if key in keys:
+                    yield key, item
+
+
+def json2dlc_config_single(json_file):
+    catalogue = CocoAnnotations.load(json_file).categories
     bodyparts = []
     skeleton = []
 
@@ -224,98 +534,264 @@ def json2dlc_config_single(json_file):
 
     return bodyparts, skeleton
 
-def copy_images(frame_dir, proj_path, js_file, scorer):
-    with open(js_file, 'r') as f:
-        data = json.load(f)
+def index_frames(frame_dir):
+    """
+    Map every file name under `frame_dir` to its path, walking the tree once with `os.scandir`.
 
-    images = data.get('images', [])
-    categories = data.get('categories', [])
-    annotations = data.get('annotations', [])
+    Files of a folder come before those of its sub-folders, and folders are visited in sorted order.
+    A name found again in another place is kept at its first path; it is reported as a duplicate
+    unless both paths are the same file (e.g. hardlinks or symlinks into 'total_video_frames') or
+    byte-identical copies (e.g. frames extracted with `link="copy"`), compared by size, then content.
 
-    category_ids = sorted(set(annotation['category_id'] for annotation in annotations))
+    Args:
+        frame_dir (str): Root folder of the frames.
 
-    category_bodyparts = {cat['id']: cat['keypoints'] for cat in categories if 'keypoints' in cat}
-    num_bodyparts_per_category = {cat_id: len(parts) for cat_id, parts in category_bodyparts.items()}
+    Returns:
+        Tuple[dict, dict]: {file name: path}, and {file name: [paths]} for the conflicting names.
+    """
+    index = {}
+    duplicates = {}
+    folders = deque([frame_dir])
+    while folders:
+        folder = folders.popleft()
+        with os.scandir(folder) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        for entry in entries:
+            if entry.is_dir():
+                folders.append(entry.path)
+            elif entry.name not in index:
+                index[entry.name] = entry.path
+            elif not (os.path.samefile(index[entry.name], entry.path)
+                      or filecmp.cmp(index[entry.name], entry.path, shallow=False)):
+                duplicates.setdefault(entry.name, [index[entry.name]]).append(entry.path)
+    return index, duplicates
+
+
+def split_frame_name(file_name):
+    """
+    Split a frame name written by `extract_frames`, '<video>_img<index>.<ext>', into the video name and
+    the name of the frame in 'labeled-data/<video>' ('img<index>.<ext>'). Other names are kept whole,
+    in a folder named after their stem.
+    """
+    pos = file_name.rfind('_img')
+    if pos < 0:
+        return os.path.splitext(file_name)[0], file_name
+    return file_name[:pos], file_name[pos + 1:]
 
+
+@staged("copy_images")
+def copy_images(frame_dir, proj_path, js_file, scorer, save_csv=True, transfer_mode="auto", transfer_workers=8,
+                shards=False, shard_size=SHARD_SIZE, update=False):
+    """
+    Copy the labeled frames into the project's 'labeled-data' folders and write their label tables.
+
+    The frames placed and a digest of each table's rows are recorded in the project's manifest (see
+    `dataprep.project_manifest`). With `update`, only frames that are new or whose source content changed
+    are placed, and only the tables whose rows changed are rewritten, merged with their existing rows.
+
+    With `shards`, the frames are instead streamed into tar shards in 'labeled-data-shards', keyed
+    '<video>/<frame>' (e.g. 'video1/img0042.png'), with the index 'labeled-data_index.json'. The label
+    tables are still written to 'labeled-data/<video>'.
+
+    Args:
+        frame_dir (str): Root folder of the extracted frames.
+        proj_path (str): Path of the DLC project.
+        js_file (str or CocoAnnotations): COCO keypoints JSON exported from CVAT, or its parsed content.
+        scorer (str): Scorer name of the project.
+        save_csv (bool): Also write each label table as CSV next to the .h5 file.
+        transfer_mode (str): How frames are placed, see `dataprep.transfer.transfer_file`.
+        transfer_workers (int): Number of concurrent file transfers.
+        shards (bool): Write the frames into tar shards instead of 'labeled-data'.
+        shard_size (int): Target maximum size of a shard in bytes.
+        update (bool): Only place the frames and rewrite the tables that changed since the last run.
+
+    Returns:
+        dict: Transfer summary of the frames (see `dataprep.transfer.transfer_files`), or with `shards`
+        the shard list and sample index (see `dataprep.shards.ShardWriter`), plus the number of label
+        tables written ("tables_written").
+    """
+    if update and shards:
+        raise ValueError("Updating is not supported with shards.")
+    metrics = current_stage()
+    coco = CocoAnnotations.load(js_file)
+    images = coco.images
+    categories = coco.categories
+    annotations = coco.annotations
+
+    frame_index, duplicates = index_frames(frame_dir)
+    if duplicates:
+        print(f"Warning: {len(duplicates)} file names appear more than once in {frame_dir} with different "
+              f"content. Using the first path of each:")
+        for name in sorted(duplicates)[:10]:
+            print(f"  {name}: {', '.join(duplicates[name])}")
+        if len(duplicates) > 10:
+            print(f"  ... and {len(duplicates) - 10} more")
+
+    # Frames extracted in another image format than the one labeled are found by their stem
+    stem_index = {}
+    for name, path in frame_index.items():
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in FRAME_EXTENSIONS:
+            stem_index.setdefault(stem, path)
+
+    labeled_images = {}
+    transfers = {}
+    missing = []
     for image in images:
         file_name = image.get('file_name')
         if file_name:
-            found = False
-            for root, dirs, files in os.walk(frame_dir):
-                if file_name in files:
-                    found = True
-                    img_path = os.path.join(root, file_name)
-
-                    video_name = file_name[:file_name.find('_img')]
-
-                    target_dir = os.path.join(proj_path, "labeled-data", video_name)
-                    os.makedirs(target_dir, exist_ok=True)
-
-                    new_file_name = file_name[file_name.find('img'):] if 'img' in file_name else file_name
-                    target_path = os.path.join(target_dir, new_file_name)
-
-                    shutil.copy(img_path, target_path)
-
-                    csv_file = os.path.join(target_dir, f"CollectedData_{scorer}.csv")
-
-                    if not os.path.exists(csv_file):
-                        with open(csv_file, mode='w', newline='') as f_csv:
-                            writer = csv.writer(f_csv)
-
-                            writer.writerow(
-                                ['scorer'] + [''] * 2 + [f'{scorer}'] * sum([2 * v for v in num_bodyparts_per_category.values()]))
-
-                            expanded_bodyparts = []
-                            for cat_id in category_ids:
-                                if cat_id in category_bodyparts:
-                                    for bp in category_bodyparts[cat_id]:
-                                        expanded_bodyparts.extend([bp, bp])
-                            writer.writerow(['bodyparts'] + [''] * 2 + expanded_bodyparts)
-                            writer.writerow(
-                                ['coords'] + [''] * 2 + ['x', 'y'] * sum(num_bodyparts_per_category.values()))
-
-                    with open(csv_file, mode='a', newline='') as f_csv:
-                        writer = csv.writer(f_csv)
-
-                        all_category_coords = {
-                            cat_id: [None] * (num_bodyparts_per_category[cat_id] * 2)
-                            for cat_id in category_ids
-                        }
-
-                        relevant_annotations = [
-                            annotation for annotation in annotations if annotation['image_id'] == image['id']
-                        ]
-
-                        for annotation in relevant_annotations:
-                            category_id = annotation['category_id']
-                            keypoints = annotation['keypoints']
-
-                            if category_id in all_category_coords:
-                                for i in range(num_bodyparts_per_category[category_id]):
-                                    keypoint_index = i * 3
-                                    if keypoint_index + 2 < len(keypoints):
-                                        x = keypoints[keypoint_index]
-                                        y = keypoints[keypoint_index + 1]
-                                        visibility = keypoints[keypoint_index + 2]
-
-
-                                        if visibility > 0:
-                                            all_category_coords[category_id][i * 2] = x
-                                            all_category_coords[category_id][i * 2 + 1] = y
-
-
-                        coords = []
-                        for cat_id in category_ids:
-                            coords.extend(all_category_coords[cat_id])
+            img_path = frame_index.get(file_name) or stem_index.get(os.path.splitext(file_name)[0])
+            if img_path is None:
+                missing.append(file_name)
+                continue
+            file_name = os.path.basename(img_path)
+
+            video_name, new_file_name = split_frame_name(file_name)
+
+            target_dir = os.path.join(proj_path, "labeled-data", video_name)
+            os.makedirs(target_dir, exist_ok=True)
+
+            target_path = os.path.join(target_dir, new_file_name)
+
+            transfers[target_path] = img_path
+            labeled_images.setdefault(video_name, []).append((new_file_name, image['id']))
+
+    metrics.update(images=len(images), frames=len(transfers), missing=len(missing), duplicates=len(duplicates),
+                   videos=len(labeled_images))
+    if missing:
+        print(f"{len(missing)} images not found in {frame_dir}: {', '.join(missing)}")
+
+    manifest = None
+    if shards:
+        shard_folder = os.path.join(proj_path, "labeled-data-shards")
+        with ShardWriter(shard_folder, "labeled-data", shard_size) as writer:
+            for dst, src in sorted(transfers.items()):
+                video_name = os.path.basename(os.path.dirname(dst))
+                stem, ext = os.path.splitext(os.path.basename(dst))
+                writer.write(f"{video_name}/{stem}", [(ext, src)])
+        summary = {"shards": writer.shards, "samples": writer.samples}
+        metrics.update(shards=len(writer.shards), bytes_written=sum(shard['bytes'] for shard in writer.shards),
+                       bytes_read=sum(os.path.getsize(src) for src in transfers.values()))
+        print(f"Labeled frames: {len(writer.samples)} frames in {len(writer.shards)} shards "
+              f"({sum(shard['bytes'] for shard in writer.shards) / 1e6:.1f} MB), index {writer.index_path}")
+    else:
+        manifest = LabeledDataManifest(os.path.join(proj_path, MANIFEST_FILE))
+        placed = manifest.changed_frames(transfers, transfer_workers) if update else transfers
+        summary = transfer_files(((src, dst) for dst, src in placed.items()), transfer_mode, transfer_workers,
+                                 skip_existing=not update)
+        summary["skipped"] += len(transfers) - len(placed)
+        if not update:
+            manifest.record_frames(transfers)
+        print(f"Labeled frames: {format_summary(summary)}")
+
+    digests = label_table_digests(labeled_images, annotations, categories, scorer)
+    if update:
+        labeled_images = {
+            video_name: entries for video_name, entries in labeled_images.items()
+            if digests[video_name] != manifest.tables.get(video_name)
+            or not os.path.exists(os.path.join(proj_path, "labeled-data", video_name, f"CollectedData_{scorer}.h5"))
+        }
+        print(f"Label tables: {len(labeled_images)} of {len(digests)} videos changed")
+    write_label_tables(labeled_images, annotations, categories, proj_path, scorer, save_csv, merge=update)
+    if manifest is not None:
+        manifest.tables.update((video_name, digests[video_name]) for video_name in labeled_images)
+        manifest.save()
+    summary["tables_written"] = len(labeled_images)
+    metrics["tables_written"] = len(labeled_images)
+    return summary
+
+
+def label_table_digests(labeled_images, annotations, categories, scorer):
+    """
+    Digest of the rows of each video's label table, to find the tables an update has to rewrite.
 
-                        row = ['labeled-data', video_name, new_file_name] + coords
-                        writer.writerow(row)
+    Args:
+        labeled_images (dict): {video name: [(image file name in labeled-data, COCO image id), ...]}.
+        annotations (List[dict]): COCO annotations.
+        categories (List[dict]): COCO categories with their 'keypoints'.
+        scorer (str): Scorer name of the project.
 
-            if not found:
-                print(f"Image {file_name} not found in {frame_dir}")
+    Returns:
+        dict: {video name: SHA-1 of the scorer, the bodyparts and the keypoints of each frame}.
+    """
+    keypoints_by_image = defaultdict(list)
+    for annotation in annotations:
+        keypoints_by_image[annotation['image_id']].append([annotation['category_id'], annotation.get('keypoints', [])])
+    header = json.dumps([scorer, [[cat.get('id'), cat.get('keypoints')] for cat in categories]])
 
+    digests = {}
+    for video_name, entries in labeled_images.items():
+        rows = [[file_name, sorted(keypoints_by_image.get(image_id, []))] for file_name, image_id in sorted(entries)]
+        digests[video_name] = hashlib.sha1((header + json.dumps(rows)).encode('utf-8')).hexdigest()
+    return digests
 
 
+def write_label_tables(labeled_images, annotations, categories, proj_path, scorer, save_csv=True, merge=False):
+    """
+    Write the DLC label table ('CollectedData_<scorer>.h5') of each video from COCO keypoint annotations.
+
+    Annotations are grouped by image id once, and each video's keypoints are filled into a NumPy
+    matrix that becomes the MultiIndex DataFrame DLC expects, so no CSV has to be parsed back.
+    Keypoints with visibility 0 are left as NaN.
+
+    Args:
+        labeled_images (dict): {video name: [(image file name in labeled-data, COCO image id), ...]}.
+        annotations (List[dict]): COCO annotations.
+        categories (List[dict]): COCO categories with their 'keypoints'.
+        proj_path (str): Path of the DLC project.
+        scorer (str): Scorer name of the project.
+        save_csv (bool): Also write each table as 'CollectedData_<scorer>.csv'.
+        merge (bool): Keep the rows of an existing table for frames not in `labeled_images` (e.g. labeled in
+            an earlier export); rows of the same frame are replaced.
+    """
+    import numpy as np
+    import pandas as pd
 
+    category_ids = sorted(set(annotation['category_id'] for annotation in annotations))
+    category_bodyparts = {cat['id']: cat['keypoints'] for cat in categories if 'keypoints' in cat}
 
+    # Each category owns a block of consecutive bodypart columns
+    offsets = {}
+    bodyparts = []
+    for cat_id in category_ids:
+        if cat_id in category_bodyparts:
+            offsets[cat_id] = len(bodyparts)
+            bodyparts.extend(category_bodyparts[cat_id])
+
+    columns = pd.MultiIndex.from_arrays(
+        [[scorer] * (2 * len(bodyparts)), [bp for bp in bodyparts for _ in range(2)], ['x', 'y'] * len(bodyparts)],
+        names=['scorer', 'bodyparts', 'coords'],
+    )
 
+    annotations_by_image = defaultdict(list)
+    for annotation in annotations:
+        annotations_by_image[annotation['image_id']].append(annotation)
+
+    for video_name, entries in labeled_images.items():
+        entries = sorted(entries)
+        coords = np.full((len(entries), len(bodyparts), 2), np.nan)
+        for row, (_, image_id) in enumerate(entries):
+            for annotation in annotations_by_image.get(image_id, ()):
+                category_id = annotation['category_id']
+                if category_id not in offsets:
+                    continue
+                keypoints = np.asarray(annotation['keypoints'], dtype=float)
+                count = min(len(category_bodyparts[category_id]), len(keypoints) // 3)
+                keypoints = keypoints[:3 * count].reshape(count, 3)
+                visible = keypoints[:, 2] > 0
+                block = coords[row, offsets[category_id]:offsets[category_id] + count]
+                block[visible] = keypoints[visible, :2]
+
+        index = pd.MultiIndex.from_tuples([('labeled-data', video_name, file_name) for file_name, _ in entries])
+        df = pd.DataFrame(coords.reshape(len(entries), -1), index=index, columns=columns)
+
+        target_dir = os.path.join(proj_path, "labeled-data", video_name)
+        os.makedirs(target_dir, exist_ok=True)
+        table_path = os.path.join(target_dir, f"CollectedData_{scorer}.h5")
+        if merge and os.path.exists(table_path):
+            previous = pd.read_hdf(table_path)
+            previous = previous[~previous.index.isin(df.index)].reindex(columns=columns)
+            df = pd.concat([previous, df]).sort_index()
+        df.to_hdf(table_path, key="df_with_missing", mode="w")
+        if save_csv:
+            df.to_csv(os.path.join(target_dir, f"CollectedData_{scorer}.csv"))
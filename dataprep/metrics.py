@@ -0,0 +1,169 @@
+import io
+import json
+import time
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger("dataprep.metrics")
+
+_sinks = []
+_profiles = {}
+_local = threading.local()
+
+
+class JsonLinesSink:
+    """
+    Append every metrics record as one JSON line to `path`. Lines are written with a single `write`
+    on a file opened in append mode, so worker processes can share the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line)
+
+
+def add_sink(sink):
+    """Call `sink(record)` for every finished stage. Returns the sink, for `remove_sink`."""
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+@contextmanager
+def metrics_file(path):
+    """Write the records of the stages run inside the block to a JSON-lines file."""
+    sink = add_sink(JsonLinesSink(path))
+    try:
+        yield sink
+    finally:
+        remove_sink(sink)
+
+
+def profile_stage(name, path=None, top=20):
+    """
+    Run every later stage called `name` under cProfile, until `stop_profiling`. The `top` entries by
+    cumulative time are logged and, with `path`, the statistics are dumped for `pstats` or snakeviz.
+    """
+    _profiles[name] = (path, top)
+
+
+def stop_profiling(name=None):
+    """Stop profiling the stage `name`, or all stages."""
+    if name is None:
+        _profiles.clear()
+    else:
+        _profiles.pop(name, None)
+
+
+def emit(record):
+    """Send a finished record to the logger and the sinks."""
+    summary = ", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                        for key, value in record.items() if key != "stage")
+    logger.info("%s: %s", record["stage"], summary, extra={"metrics": record})
+    for sink in list(_sinks):
+        sink(record)
+
+
+def record(name, **fields):
+    """Emit a record for work measured elsewhere, e.g. per-video stats returned by a worker process."""
+    emit({"stage": name, "parent": _current(), **fields})
+
+
+def _current():
+    stack = getattr(_local, "stack", None)
+    return stack[-1][0] if stack else None
+
+
+def current_stage():
+    """
+    Counters of the innermost stage running in this thread. Outside any stage a detached
+    `StageMetrics` is returned, so instrumented code does not need to check.
+    """
+    stack = getattr(_local, "stack", None)
+    return stack[-1][1] if stack else StageMetrics()
+
+
+class StageMetrics(dict):
+    """Counters of a running stage. `add` accumulates; plain item assignment sets a field."""
+
+    def add(self, key, value=1):
+        self[key] = self.get(key, 0) + value
+
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Measure a stage of the pipeline.
+
+    The block receives a `StageMetrics` dict to fill with counters (frames decoded and kept, bytes read
+    and written, files copied or linked...). When the block ends, the record {"stage", "parent",
+    "seconds", **fields, **counters} is logged on the 'dataprep.metrics' logger (INFO) and passed to the
+    sinks, also when the block raises (with "error" set). Stages nest; "parent" is the enclosing stage.
+
+        with stage("copy_images", scorer=scorer) as m:
+            m.add("files", 10)
+    """
+    metrics = StageMetrics(fields)
+    parent = _current()
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append((name, metrics))
+
+    profile = _profiles.get(name)
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    error = None
+    try:
+        yield metrics
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        seconds = time.perf_counter() - start
+        stack.pop()
+        result = {"stage": name, "parent": parent, "seconds": seconds, **metrics}
+        if error:
+            result["error"] = error
+        emit(result)
+        if profiler:
+            _report_profile(name, profiler, *profile)
+
+
+def staged(name):
+    """Decorator running every call of a function as the stage `name` (see `stage`, `current_stage`)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _report_profile(name, profiler, path, top):
+    import pstats
+
+    if path:
+        profiler.dump_stats(path)
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(top)
+    logger.info("Profile of %s%s:\n%s", name, f" (saved to {path})" if path else "", text.getvalue())
@@ -0,0 +1,94 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from dataprep.metrics import current_stage
+
+MANIFEST_FILE = ".labeled_data_manifest.json"
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    """SHA-1 of a file's content, read in chunks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LabeledDataManifest:
+    """
+    Record of what `copy_images` placed in a DLC project: the size, mtime and content hash of the
+    source of every frame in 'labeled-data', and a digest of the rows of every label table. An update
+    then transfers only the frames and rewrites only the tables that changed.
+
+    A source whose size and mtime match the record is unchanged without being read. Otherwise its
+    SHA-1 is compared with the recorded one, so a file that was only touched or exported again is
+    not placed again. Hashes are computed for new and changed files only.
+
+    Args:
+        path (str): Manifest file, usually `MANIFEST_FILE` in the project folder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.frames = {}
+        self.tables = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                self.frames = data["frames"]
+                self.tables = data["tables"]
+            except (OSError, ValueError, KeyError):
+                print(f"Warning: Ignoring unreadable labeled-data manifest {path}")
+
+    def _key(self, dst):
+        return os.path.relpath(os.path.abspath(dst), self.root).replace(os.sep, '/')
+
+    def changed_frames(self, transfers, workers=8):
+        """
+        Select the frames that are new or whose source content changed since they were recorded.
+
+        Args:
+            transfers (dict): {destination path: source path} of all labeled frames.
+            workers (int): Number of threads hashing sources.
+
+        Returns:
+            dict: The subset of `transfers` to place again. Their records are updated, so call
+            `save` once they are placed. The bytes hashed are added to "bytes_read" of the current stage.
+        """
+        to_hash = []
+        for dst, src in transfers.items():
+            stat = os.stat(src)
+            entry = self.frames.get(self._key(dst))
+            if (entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+                    and os.path.lexists(dst)):
+                continue
+            to_hash.append((dst, src, stat))
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            hashes = list(pool.map(file_sha1, [src for _, src, _ in to_hash]))
+        current_stage().add("bytes_read", sum(stat.st_size for _, _, stat in to_hash))
+
+        changed = {}
+        for (dst, src, stat), digest in zip(to_hash, hashes):
+            key = self._key(dst)
+            entry = self.frames.get(key)
+            if not (entry and entry["sha1"] == digest and os.path.lexists(dst)):
+                changed[dst] = src
+            self.frames[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": digest}
+        return changed
+
+    def record_frames(self, transfers):
+        """Record frames as placed, by the size and mtime of their sources (the hash is left unknown)."""
+        for dst, src in transfers.items():
+            stat = os.stat(src)
+            self.frames[self._key(dst)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": None}
+
+    def save(self):
+        """Write the manifest via a temporary file, so an interrupted run keeps the previous one."""
+        with open(self.path + ".tmp", 'w') as f:
+            json.dump({"frames": self.frames, "tables": self.tables}, f)
+        os.replace(self.path + ".tmp", self.path)
@@ -0,0 +1,116 @@
+import os
+import json
+import tarfile
+
+SHARD_SIZE = 1 << 30
+TAR_BLOCK = 512
+
+
+def _tar_size(path):
+    """Bytes a file takes in a tar archive: one header block plus the data padded to whole blocks."""
+    size = os.path.getsize(path)
+    return TAR_BLOCK + (size + TAR_BLOCK - 1) // TAR_BLOCK * TAR_BLOCK
+
+
+class ShardWriter:
+    """
+    Write samples into size-bounded tar shards in the WebDataset layout.
+
+    All files of a sample share a key and differ only by extension ('key.png', 'key.txt'), so
+    WebDataset and plain `tarfile` readers can regroup them. Files are streamed from disk into the
+    open shard (symlinks are followed), and a sample is never split across two shards. Each shard is
+    written under a temporary name and renamed when complete; shards left by an earlier writer with the
+    same prefix are deleted. On `close`, an index '<prefix>_index.json' lists the shards and the shard
+    and members of every sample.
+
+    Args:
+        folder (str): Output folder of the shards.
+        prefix (str): Shard names are '<prefix>-000000.tar', '<prefix>-000001.tar', ...
+        max_bytes (int): Target maximum size of a shard. A single larger sample gets its own shard.
+    """
+
+    def __init__(self, folder, prefix="shard", max_bytes=SHARD_SIZE):
+        self.folder = folder
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.shards = []
+        self.samples = {}
+        self._tar = None
+        os.makedirs(folder, exist_ok=True)
+        # Shards of an earlier run with the same prefix would otherwise linger past the new last shard
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.name.startswith(prefix + "-") and entry.name.endswith((".tar", ".tar.tmp")):
+                    os.remove(entry.path)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.folder, f"{self.prefix}_index.json")
+
+    def _open_shard(self):
+        self._close_shard()
+        name = f"{self.prefix}-{len(self.shards):06d}.tar"
+        self._tar = tarfile.open(os.path.join(self.folder, name + ".tmp"), "w", dereference=True)
+        self.shards.append({"name": name, "samples": 0, "bytes": 0})
+
+    def _close_shard(self):
+        if self._tar is None:
+            return
+        path = self._tar.name
+        self._tar.close()
+        self._tar = None
+        self.shards[-1]["bytes"] = os.path.getsize(path)
+        os.replace(path, path[:-len(".tmp")])
+
+    def write(self, key, files):
+        """
+        Append one sample.
+
+        Args:
+            key (str): Sample key, e.g. 'video1_img0042' or 'video1/img0042'. Must not contain a '.'.
+            files (List[Tuple[str, str]]): (extension, source path) of each file, e.g. ('png', path).
+        """
+        if key in self.samples:
+            raise ValueError(f"Duplicate sample key: {key}")
+        size = sum(_tar_size(path) for _, path in files)
+        if self._tar is None or (self.shards[-1]["samples"] and self._tar.offset + size > self.max_bytes):
+            self._open_shard()
+        members = []
+        for ext, path in files:
+            arcname = f"{key}.{ext.lstrip('.')}"
+            self._tar.add(path, arcname=arcname, recursive=False)
+            members.append(arcname)
+        self.shards[-1]["samples"] += 1
+        self.samples[key] = {"shard": self.shards[-1]["name"], "files": members}
+
+    def close(self):
+        """Finish the last shard and write the index."""
+        self._close_shard()
+        with open(self.index_path + ".tmp", 'w') as f:
+            json.dump({"shards": self.shards, "samples": self.samples}, f, indent=1)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_shards(samples, folder, prefix="shard", max_bytes=SHARD_SIZE):
+    """
+    Write (key, files) samples into tar shards with a `ShardWriter`.
+
+    Returns:
+        List[str]: Paths of the shards, in order.
+    """
+    with ShardWriter(folder, prefix, max_bytes) as writer:
+        for key, files in samples:
+            writer.write(key, files)
+    return [os.path.join(folder, shard["name"]) for shard in writer.shards]
+
+
+def load_shard_index(index_path):
+    """Load the index written by `ShardWriter.close`: {"shards": [...], "samples": {key: {...}}}."""
+    with open(index_path, 'r') as f:
+        return json.load(f)
@@ -0,0 +1,127 @@
+import os
+import sys
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataprep.metrics import current_stage, staged
+
+TRANSFER_MODES = ("auto", "hardlink", "reflink", "symlink", "copy")
+
+# Linux ioctl that clones a file's extents (copy-on-write) on Btrfs, XFS, bcachefs...
+_FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    """Create `dst` as a copy-on-write clone of `src`. Raises OSError where unsupported."""
+    if sys.platform.startswith("linux"):
+        import fcntl
+        with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+            try:
+                fcntl.ioctl(f_dst.fileno(), _FICLONE, f_src.fileno())
+            except OSError:
+                f_dst.close()
+                os.remove(dst)
+                raise
+    elif sys.platform == "darwin":
+        import ctypes
+        libc = ctypes.CDLL("libc.dylib", use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            raise OSError(ctypes.get_errno(), "clonefile failed")
+    else:
+        raise OSError("Reflinks are not supported on this platform")
+    shutil.copystat(src, dst)
+
+
+def is_up_to_date(src, dst):
+    """Whether `dst` exists with the size and modification time (within 1 s) of `src`."""
+    try:
+        src_stat = os.stat(src)
+        dst_stat = os.stat(dst)
+    except OSError:
+        return False
+    return src_stat.st_size == dst_stat.st_size and abs(src_stat.st_mtime - dst_stat.st_mtime) <= 1
+
+
+def transfer_file(src, dst, mode="auto"):
+    """
+    Place `src` at `dst` as a hardlink, reflink, symlink or copy, falling back to a real copy.
+
+    Args:
+        src (str): Source file.
+        dst (str): Destination path. An existing file there is replaced.
+        mode (str): "auto" (hardlink, else reflink, else copy), "hardlink", "reflink", "symlink" or "copy".
+
+    Returns:
+        str: How the file was placed: "hardlink", "reflink", "symlink" or "copy".
+    """
+    if mode not in TRANSFER_MODES:
+        raise ValueError(f"Unknown transfer mode: {mode}. Choose from {TRANSFER_MODES}.")
+
+    if os.path.lexists(dst):
+        os.remove(dst)
+    attempts = {"auto": ("hardlink", "reflink"), "hardlink": ("hardlink",), "reflink": ("reflink",),
+                "symlink": ("symlink",), "copy": ()}[mode]
+    for attempt in attempts:
+        try:
+            if attempt == "hardlink":
+                os.link(src, dst)
+            elif attempt == "reflink":
+                _reflink(src, dst)
+            else:
+                os.symlink(os.path.abspath(src), dst)
+            return attempt
+        except OSError:
+            continue
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+@staged("transfer_files")
+def transfer_files(pairs, mode="auto", workers=8, skip_existing=True):
+    """
+    Transfer many files with bounded thread concurrency.
+
+    Args:
+        pairs (Iterable[Tuple[str, str]]): (source, destination) paths. Destination folders must exist.
+        mode (str): Transfer mode, see `transfer_file`.
+        workers (int): Maximum number of concurrent transfers.
+        skip_existing (bool): Skip destinations that already match the source in size and mtime.
+
+    Returns:
+        dict: Number of files per outcome ("hardlink", "reflink", "symlink", "copy", "skipped"),
+        "bytes_copied" (bytes actually written) and "bytes_linked" (bytes placed without copying).
+        The summary is also the record of the "transfer_files" stage (see `dataprep.metrics`), with
+        "bytes_read": only copies read their source, so it equals "bytes_copied".
+    """
+    summary = {"hardlink": 0, "reflink": 0, "symlink": 0, "copy": 0, "skipped": 0,
+               "bytes_copied": 0, "bytes_linked": 0}
+    lock = threading.Lock()
+
+    def transfer(pair):
+        src, dst = pair
+        if skip_existing and is_up_to_date(src, dst):
+            outcome = "skipped"
+        else:
+            outcome = transfer_file(src, dst, mode)
+        size = os.path.getsize(src)
+        with lock:
+            summary[outcome] += 1
+            if outcome == "copy":
+                summary["bytes_copied"] += size
+            elif outcome != "skipped":
+                summary["bytes_linked"] += size
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # Consume the iterator so worker exceptions are raised here
+        for _ in pool.map(transfer, pairs):
+            pass
+    current_stage().update(summary, mode=mode, bytes_read=summary["bytes_copied"])
+    return summary
+
+
+def format_summary(summary):
+    """One-line description of a `transfer_files` summary."""
+    placed = ", ".join(f"{summary[key]} {key}" for key in ("copy", "hardlink", "reflink", "symlink", "skipped")
+                       if summary[key])
+    return (f"{placed or '0 files'} ({summary['bytes_copied'] / 1e6:.1f} MB copied, "
+            f"{summary['bytes_linked'] / 1e6:.1f} MB linked)")
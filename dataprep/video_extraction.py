@@ -1,11 +1,34 @@
 import os
-import cv2
+import json
+import time
 import random
+import hashlib
+import tempfile
 import numpy as np
-from tqdm import tqdm
-from sklearn.cluster import MiniBatchKMeans
+from dataprep.dedup import HashIndex
+from dataprep.frame_store import FrameStore
+from dataprep.frame_writer import FrameWriter
+from dataprep.journal import JOURNAL_FOLDER, ExtractionJournal, journal_key
+from dataprep.metrics import current_stage, record, stage, staged
+from dataprep.video_meta import METADATA_FILE, probe_videos
+from dataprep.video_reader import SEEK_THRESHOLD, as_reader, open_video, resolve_backend
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Feature matrices for K-means larger than this many bytes are kept in a memmap on disk.
+MEMMAP_BYTES = 1 << 30
+
+METHODS = ("uniform", "random", "kmeans", "global_kmeans", "motion")
+
+# Crop and scale of the frames of each video, written next to them when frames are cropped or scaled
+TRANSFORMS_FILE = "frame_transforms.json"
+
+# Options of `_extract_video` that decide which frames are selected and how they are written (see `journal_key`)
+JOURNAL_OPTIONS = ("method", "seed", "subfolder", "resize_width", "batch_size", "max_iter", "kmeans_streaming",
+                   "kmeans_step", "motion_metric", "motion_step", "dedup_threshold", "image_format", "quality",
+                   "png_compression", "scale")
 
 # for kmeans methods, find original code: from deeplabcut.utils import frameselectiontools
+@staged("extract_frames")
 def extract_frames(
         input_path,
         output_folder=None,
@@ -16,7 +39,30 @@ def extract_frames(
         subfolder=True,
         resize_width=30,
         batch_size=100,
-        max_iter=50
+        max_iter=50,
+        seek_threshold=SEEK_THRESHOLD,
+        workers=1,
+        writer_threads=4,
+        max_pending=32,
+        link="hardlink",
+        kmeans_streaming=False,
+        kmeans_step=1,
+        cache_dir=None,
+        motion_metric="diff",
+        motion_step=1,
+        dedup_threshold=None,
+        dedup_index=None,
+        frame_store=False,
+        image_format="png",
+        quality=None,
+        png_compression=None,
+        crop=None,
+        scale=1.0,
+        config=None,
+        resume=False,
+        decode_backend="opencv",
+        decode_threads=0,
+        metadata_cache=None
 ):
     """
     Extract frames from videos and save them into specified folders.
@@ -26,163 +72,1003 @@ def extract_frames(
         output_folder (str): Root directory to save extracted frames. If None, a folder with the video name is created.
         percentage (int, optional): Percentage of frames to extract (0-100). Used if frame_number is None.
         frame_number (int, optional): Number of frames to extract. Overrides percentage if set.
-        method (str): Extraction method, either "uniform", "random", or "kmeans".
-        seed (int): Random seed for reproducibility.
+        method (str): Extraction method, either "uniform", "random", "kmeans", "global_kmeans" or "motion".
+            "global_kmeans" clusters the frames of all videos together and treats the frame budget as a total
+            over all videos (see `global_kmeans_frame_selection`). "motion" picks frames at motion peaks or
+            scene changes (see `motion_frame_selection`).
+        seed (int): Random seed for reproducibility. Each video draws from its own generator seeded
+            with it, so the selection does not depend on `workers` or on the order of the videos.
         subfolder (bool): Whether to save frames in a subfolder per video.
         resize_width (int): Resize the frame width for K-means clustering.
         batch_size (int): Batch size for K-means clustering.
         max_iter (int): Maximum iterations for K-means.
+        seek_threshold (int): Gap between selected frames above which the reader seeks instead
+            of decoding forward (see `dataprep.video_reader.plan_reads`).
+        workers (int): Number of processes extracting videos in parallel. Each video is handled
+            by one process with its own video reader.
+        writer_threads (int): Number of background threads encoding frames while decoding continues.
+        max_pending (int): Maximum number of decoded frames waiting to be written, per video.
+        link (str): How the copy in the total frames folder is made when `subfolder` is True:
+            "hardlink", "symlink" or "copy". Links fall back to a copy where unsupported.
+        kmeans_streaming (bool): Cluster every `kmeans_step`-th frame of the whole video instead of
+            1000 samples (see `kmeans_frame_selection`).
+        kmeans_step (int): Sampling step of the streaming K-means mode.
+        cache_dir (str, optional): Folder to cache K-means features in, so that reruns with another
+            frame budget do not decode the videos again.
+        motion_metric (str): Score of the "motion" method: "diff" (frame-difference energy) or "hist"
+            (histogram distance, for scene changes).
+        motion_step (int): Score every `motion_step`-th frame for the "motion" method.
+        dedup_threshold (int, optional): Skip frames whose perceptual hash is within this many bits of a
+            frame already kept (see `dataprep.dedup`). None disables deduplication. With `workers` > 1,
+            each video is compared with the frames kept by earlier runs and by itself, not with the
+            other videos of the same run.
+        dedup_index (str, optional): .npy file of kept hashes, loaded before and updated after the run.
+            Defaults to 'frame_hashes.npy' in the output folder.
+        frame_store (bool): Instead of one PNG per frame, append the frames of each video to a memmap
+            in 'frame_store' in the output folder (see `dataprep.frame_store.FrameStore`). Read them with
+            `FrameStoreReader`, which also exports PNG/JPEG files on demand.
+        image_format (str): Format of the frame files: "png", "jpeg" or "webp".
+        quality (int, optional): JPEG/WebP quality (1-100). None keeps the OpenCV default (95).
+        png_compression (int, optional): PNG compression level (0-9). None keeps the OpenCV default (1).
+        crop (tuple or dict, optional): Region to keep, as DeepLabCut's (x1, x2, y1, y2), for all videos or
+            as {video name: (x1, x2, y1, y2)}. Frames are still selected on the full image.
+        scale (float): Resize factor applied after cropping, e.g. 0.5 to halve the width and height.
+        config (str, optional): DeepLabCut config.yaml to take the crop boxes from when `crop` does not
+            give one (see `load_crop_config`). When frames are cropped or scaled, the box, the scale and
+            the kept frame indices of each video are stored in 'frame_transforms.json' in the output
+            folder; `to_original_coordinates` maps labels back to the full frame.
+        resume (bool): Continue from the journal of an earlier run in the same output folder. Videos
+            that were finished are skipped without being opened, and interrupted ones only write the frames
+            not completed yet. With "global_kmeans", the joint selection is reused without extracting
+            features when every video has a journal of it. If only the frame budget changed, frames of the
+            earlier selection that are selected again are not rewritten (frames no longer selected are left
+            in place). Every run keeps a journal per video in '.extraction_journal' (not with
+            `frame_store`); frames are written to a temporary file and renamed, so an interrupted run
+            leaves no partial images.
+        decode_backend (str): How videos are decoded: "opencv" (`cv2.VideoCapture`), "pyav" (FFmpeg through
+            PyAV, with multithreaded decoding and keyframe seeking) or "auto" (PyAV when installed). Both number
+            frames like a sequential read, also for variable frame rates. See `dataprep.video_reader`.
+        decode_threads (int): Decoding threads per video with PyAV; 0 lets FFmpeg pick one per core. Lower it
+            when `workers` > 1, so the processes do not oversubscribe the cores.
+        metadata_cache (str, optional): File caching the video metadata (frame counts). Defaults to
+            '.video_metadata.json' next to the videos; point it elsewhere, e.g. into the output folder,
+            when the video folder is read-only or shared.
+
+    The run is measured as the stage "extract_frames", with one "extract_video" record per video
+    (see `dataprep.metrics`).
 
     Returns:
-        None
+        List[dict]: Per-video stats ("video", "total_frames", "frames_written", "decoded", "seeks",
+        "duplicates", "seconds", "encode_seconds", "bytes_written", "bytes_read", "video_bytes"), in the order
+        of the videos. "decoded_exact" is False with OpenCV, whose seeks decode frames that "decoded" cannot
+        count (see `dataprep.video_reader.OpenCVReader`). "bytes_read" is measured with PyAV only and is None
+        with OpenCV; "video_bytes" is the size of the video file.
     """
+    from tqdm import tqdm
+
+    metrics = current_stage()
+    metrics.update(method=method, workers=workers, decode_backend=resolve_backend(decode_backend))
+
     # Check if the input is a folder or a single file
     if os.path.isdir(input_path):
         # videos = [os.path.join(input_path, f) for f in os.listdir(input_path) if f.endswith(('.mp4', '.avi'))]
-        videos = [
+        videos = sorted(
             os.path.join(input_path, f)
             for f in os.listdir(input_path)
             if f.lower().endswith(('.mp4', '.avi', '.mov', '.mkv'))
-        ]
+        )
     elif os.path.isfile(input_path):
         videos = [input_path]
     else:
         raise ValueError("The input path must be a valid video file or a folder containing videos.")
 
-    # Create a total folder if multiple videos are present
-    if len(videos) > 1:
-        total_frames_folder = os.path.join(output_folder,
-                                           "total_video_frames") if output_folder else "total_video_frames"
-        os.makedirs(total_frames_folder, exist_ok=True)
+    # Frame counts come from the metadata cache (next to the videos by default), so unchanged videos are not
+    # probed again
+    if metadata_cache is None and videos:
+        metadata_cache = os.path.join(os.path.dirname(os.path.abspath(videos[0])), METADATA_FILE)
+    metadata = probe_videos(videos, metadata_cache)
+    for video_path in [v for v in videos if metadata[v] is None]:
+        print(f"Warning: Cannot open video file {video_path}! Skipping...")
+        videos.remove(video_path)
+    metrics["videos"] = len(videos)
+
+    if frame_number is None and percentage is None:
+        raise ValueError("Either 'percentage' or 'frame_number' must be specified.")
+    if frame_number is None and (percentage < 0 or percentage > 100):
+        raise ValueError("Percentage must be between 0 and 100.")
+    if method not in METHODS:
+        raise ValueError(f"Unknown extraction method: {method}")
+    if scale <= 0:
+        raise ValueError("Scale must be positive.")
+    if resume and frame_store:
+        raise ValueError("Resuming is not supported with frame_store.")
+
+    config_crops = load_crop_config(config) if config else {}
+
+    def crop_box(video_path):
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        box = crop.get(video_name) if isinstance(crop, dict) else crop
+        if box is None:
+            box = config_crops.get(video_name, config_crops.get(None))
+        width, height = metadata[video_path]["width"], metadata[video_path]["height"]
+        if box is None:
+            return None
+        x1, x2, y1, y2 = (int(v) for v in box)
+        box = (max(0, x1), min(width, x2), max(0, y1), min(height, y2))
+        if box[0] >= box[1] or box[2] >= box[3]:
+            raise ValueError(f"Crop box {tuple(int(v) for v in (x1, x2, y1, y2))} is outside video {video_path}")
+        return None if box == (0, width, 0, height) else box
+
+    if frame_store:
+        total_frames_folder = None
     else:
         total_frames_folder = os.path.join(output_folder,
                                            "total_video_frames") if output_folder else "total_video_frames"
         os.makedirs(total_frames_folder, exist_ok=True)
 
-        # Process each video
-    for video_path in videos:
-        video_name = os.path.splitext(os.path.basename(video_path))[0]
+    options = dict(
+        output_folder=output_folder,
+        total_frames_folder=total_frames_folder,
+        percentage=percentage,
+        frame_number=frame_number,
+        method=method,
+        seed=seed,
+        subfolder=subfolder,
+        resize_width=resize_width,
+        batch_size=batch_size,
+        max_iter=max_iter,
+        seek_threshold=seek_threshold,
+        writer_threads=writer_threads,
+        max_pending=max_pending,
+        link=link,
+        kmeans_streaming=kmeans_streaming,
+        kmeans_step=kmeans_step,
+        cache_dir=cache_dir,
+        motion_metric=motion_metric,
+        motion_step=motion_step,
+        dedup_threshold=dedup_threshold,
+        frame_store=frame_store,
+        image_format=image_format,
+        quality=quality,
+        png_compression=png_compression,
+        scale=scale,
+        resume=resume,
+        decode_backend=decode_backend,
+        decode_threads=decode_threads,
+    )
 
-        # Create a specific folder for this video
-        save_folder = os.path.join(output_folder, video_name) if output_folder else video_name
-        os.makedirs(save_folder, exist_ok=True)
+    # Journal keys, and the journals of an earlier run with the same options and budget. Videos it finished
+    # are not opened again. A joint global selection is reused only if every video has its part of it.
+    keys = {}
+    journals = {}
+    if not frame_store:
+        for video_path in videos:
+            keys[video_path] = _extraction_key(video_path, options, crop_box(video_path),
+                                               videos if method == "global_kmeans" else None)
+            if resume:
+                journal = ExtractionJournal(_journal_path(output_folder, video_path))
+                budget = _frame_budget(metadata[video_path]["frames"], frame_number, percentage)
+                if journal.key == keys[video_path] and journal.budget == budget:
+                    journals[video_path] = journal
+    if method == "global_kmeans" and len(journals) < len(videos):
+        journals = {}
+    finished = {video_path: journal for video_path, journal in journals.items() if journal.done}
 
-        cap = cv2.VideoCapture(video_path)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        print(f"Video '{video_name}' has '{total_frames}' frames")
-
-        # Select frames based on the method
-        if frame_number is not None:
-            if frame_number > total_frames:
-                print(
-                    f"Warning: Requested {frame_number} frames, but video only has {total_frames} frames. Extracting all.")
-                frame_number = total_frames
-            if method == "random":
-                if seed is not None:
-                    random.seed(seed)
-                frame_indices = sorted(random.sample(range(total_frames), frame_number))
-            elif method == "uniform":
-                step = max(1, total_frames // frame_number)
-                frame_indices = list(range(0, total_frames, step))[:frame_number]
-            elif method == "kmeans":
-                frame_indices = kmeans_frame_selection(cap, frame_number, resize_width, batch_size, max_iter)
-            else:
-                raise ValueError(f"Unknown extraction method: {method}")
-        elif percentage is not None:
-            if percentage < 0 or percentage > 100:
-                raise ValueError("Percentage must be between 0 and 100.")
-            num_frames = int(total_frames * (percentage / 100))
-            if method == "random":
-                if seed is not None:
-                    random.seed(seed)
-                frame_indices = sorted(random.sample(range(total_frames), num_frames))
-            elif method == "uniform":
-                step = max(1, total_frames // num_frames)
-                frame_indices = list(range(0, total_frames, step))[:num_frames]
+    # Pick the frames of all videos at once for the global method
+    selections = {}
+    if method == "global_kmeans" and journals:
+        selections = {video_path: journals[video_path].selected for video_path in videos}
+    elif method == "global_kmeans":
+        for video_path, i in global_kmeans_frame_selection(videos, frame_number, percentage, resize_width, batch_size,
+                                                           max_iter, seek_threshold, kmeans_streaming, kmeans_step,
+                                                           cache_dir, workers,
+                                                           {v: metadata[v]["frames"] for v in videos},
+                                                           decode_backend, decode_threads):
+            selections.setdefault(video_path, []).append(i)
+
+    hash_index = None
+    if dedup_threshold is not None:
+        dedup_index = dedup_index or os.path.join(output_folder or ".", "frame_hashes.npy")
+        hash_index = HashIndex(dedup_index, dedup_threshold)
+
+    # Process each video, in this process or one process per video
+    results = [None] * len(videos)
+    transforms = {}
+    with tqdm(total=len(videos), desc="Extracting frames", unit="video") as progress:
+        def report(index, stats):
+            for message in stats.pop("messages", ()):
+                progress.write(f"Video '{stats['video']}': {message}")
+            if hash_index is not None:
+                hash_index.extend(stats.pop("hashes", []))
+            if "transform" in stats:
+                transforms[stats["video"]] = stats.pop("transform")
+            results[index] = stats
+            record("extract_video", **stats)
+            for key in ("decoded", "frames_written", "reused", "duplicates", "seeks", "bytes_written",
+                        "video_bytes", "encode_seconds"):
+                metrics.add(key, stats[key])
+            if stats["bytes_read"] is not None:
+                metrics.add("bytes_read", stats["bytes_read"])
+            progress.write(f"Video '{stats['video']}' has '{stats['total_frames']}' frames: "
+                           f"decoded {stats['decoded']} to keep {stats['frames_written']} "
+                           + (f"(+{stats['reused']} from an earlier run) " if stats["reused"] else "")
+                           + f"({stats['seeks']} seeks, {stats['duplicates']} duplicates, {stats['seconds']:.1f}s)"
+                           + _encode_summary(stats["frames_written"], stats["encode_seconds"],
+                                             stats["bytes_written"]))
+            if method != "global_kmeans" and frame_number is not None and frame_number > stats["total_frames"]:
+                progress.write(f"Warning: Requested {frame_number} frames, but video only has "
+                               f"{stats['total_frames']} frames. Extracted all.")
+            progress.update(1)
+            progress.set_postfix(frames=sum(r["frames_written"] for r in results if r))
+
+        def known_hashes():
+            return None if hash_index is None else np.array(hash_index.hashes)
+
+        pending = []
+        for index, video_path in enumerate(videos):
+            if video_path in finished:
+                report(index, _finished_stats(video_path, metadata[video_path]["frames"], finished[video_path]))
             else:
-                raise ValueError(f"Unknown extraction method: {method}")
+                pending.append((index, video_path))
+
+        if workers > 1 and len(pending) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+                futures = {pool.submit(_extract_video, video_path, metadata[video_path]["frames"],
+                                       frame_indices=selections.get(video_path), known_hashes=known_hashes(),
+                                       crop=crop_box(video_path), key=keys.get(video_path), **options): index
+                           for index, video_path in pending}
+                for future in as_completed(futures):
+                    report(futures[future], future.result())
         else:
-            raise ValueError("Either 'percentage' or 'frame_number' must be specified.")
+            for index, video_path in pending:
+                report(index, _extract_video(video_path, metadata[video_path]["frames"],
+                                             frame_indices=selections.get(video_path), known_hashes=known_hashes(),
+                                             crop=crop_box(video_path), key=keys.get(video_path), show_progress=True,
+                                             **options))
 
-        frame_counter = 0
-        for i in frame_indices:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, i)
-            ret, frame = cap.read()
-            if not ret:
-                continue
+    if hash_index is not None:
+        hash_index.save()
+    if transforms:
+        save_transforms(os.path.join(output_folder or ".", TRANSFORMS_FILE), transforms)
+
+    written = sum(r["frames_written"] for r in results)
+    print(f"Wrote {written} frames in total" + _encode_summary(written, sum(r["encode_seconds"] for r in results),
+                                                               sum(r["bytes_written"] for r in results)))
+    if total_frames_folder:
+        print(f"All frames have also been saved to the total frames folder '{total_frames_folder}'.")
+    else:
+        print(f"All frames have been stored in '{os.path.join(output_folder or '.', 'frame_store')}'.")
+
+    return results
+
+
+def _extract_video(video_path, total_frames, output_folder, total_frames_folder, percentage, frame_number, method, seed,
+                   subfolder, resize_width, batch_size, max_iter, seek_threshold, writer_threads, max_pending, link,
+                   kmeans_streaming, kmeans_step, cache_dir, motion_metric, motion_step, dedup_threshold,
+                   frame_store=False, image_format="png", quality=None, png_compression=None, scale=1.0,
+                   resume=False, decode_backend="opencv", decode_threads=0, frame_indices=None, known_hashes=None,
+                   crop=None, key=None, show_progress=False):
+    """
+    Select and save the frames of a single video. Runs in a worker process when `workers` > 1.
+
+    `frame_indices` holds the frames already picked by a cross-video method; None selects them here.
+    `known_hashes` are the perceptual hashes of frames kept before, used when `dedup_threshold` is set.
+    `crop` is the (x1, x2, y1, y2) box already clipped to the frame, or None for the full frame.
+    `key` is the journal key of the video and its options (see `_extraction_key`), None with `frame_store`.
+
+    Returns:
+        dict: Stats of the video ("video", "total_frames", "frames_written", "decoded", "decoded_exact", "seeks",
+        "duplicates", "seconds", "encode_seconds", "bytes_written", "bytes_read", "video_bytes", "reused"), plus
+        the new "hashes" when deduplicating, the "transform" when cropping or scaling, and the "messages" of
+        the frame selection, which the caller writes above its progress bar.
+    """
+    start_time = time.perf_counter()
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    rng = random.Random(seed)
+
+    # Create a specific folder for this video
+    save_folder = os.path.join(output_folder, video_name) if output_folder else video_name
+    if not frame_store:
+        os.makedirs(save_folder, exist_ok=True)
+
+    cap = open_video(video_path, decode_backend, decode_threads)
+
+    # Select frames based on the method
+    num_frames = _frame_budget(total_frames, frame_number, percentage)
+
+    # The journal records the selection and the completed frames, so an interrupted run can resume
+    journal = None
+    reusable = False
+    if not frame_store:
+        journal = ExtractionJournal(_journal_path(output_folder, video_path))
+        reusable = resume and journal.key == key
+
+    messages = []
+    if reusable and journal.budget == num_frames and method != "global_kmeans":
+        # Same options and budget: the earlier selection stands
+        frame_indices = journal.selected
+    elif method == "global_kmeans":
+        frame_indices = frame_indices or []
+    elif method == "random":
+        frame_indices = sorted(rng.sample(range(total_frames), num_frames))
+    elif method == "uniform":
+        step = max(1, total_frames // max(1, num_frames))
+        frame_indices = list(range(0, total_frames, step))[:num_frames]
+    elif method == "kmeans":
+        frame_indices = kmeans_frame_selection(cap, num_frames, resize_width, batch_size, max_iter,
+                                               seek_threshold, show_progress, kmeans_streaming, kmeans_step,
+                                               video_path, cache_dir, messages=messages)
+    elif method == "motion":
+        frame_indices = motion_frame_selection(cap, num_frames, motion_metric, motion_step,
+                                               seek_threshold=seek_threshold, show_progress=show_progress)
+    else:
+        raise ValueError(f"Unknown extraction method: {method}")
+
+    completed = set()
+    if journal is not None:
+        if reusable:
+            completed = journal.completed.intersection(frame_indices)
+        journal.start(key, num_frames, frame_indices, completed)
+    frame_indices = [i for i in frame_indices if i not in completed]
+
+    hash_index = None
+    if dedup_threshold is not None:
+        hash_index = HashIndex(threshold=dedup_threshold)
+        hash_index.extend(known_hashes if known_hashes is not None else [])
+        num_known = len(hash_index)
+
+    transform = None
+    if crop is not None or scale != 1:
+        transform = {"crop": list(crop) if crop is not None else None, "scale": None, "frames": []}
 
+    read_stats = {}
+    duplicates = 0
+    journaled = 0
+    if frame_store:
+        # One preallocated memmap per video instead of one image per frame
+        writer = FrameStore(os.path.join(output_folder or ".", "frame_store"), video_name, len(frame_indices))
+    else:
+        writer = FrameWriter(writer_threads, max_pending, link, image_format, quality, png_compression)
+    with writer:
+        for i, frame in cap.read(frame_indices, seek_threshold, read_stats):
+            if transform is not None:
+                if transform["crop"] is None:
+                    transform["crop"] = [0, frame.shape[1], 0, frame.shape[0]]
+                frame = crop_and_scale(frame, crop, scale)
+                if transform["scale"] is None:
+                    # Actual factors per axis, after rounding to whole pixels
+                    x1, x2, y1, y2 = transform["crop"]
+                    transform["scale"] = [frame.shape[1] / (x2 - x1), frame.shape[0] / (y2 - y1)]
+            if hash_index is not None and not hash_index.keep(frame):
+                duplicates += 1
+                if journal is not None:
+                    journal.update([i])
+                continue
+            if transform is not None:
+                transform["frames"].append(i)
+            if frame_store:
+                writer.append(i, frame)
+                continue
             # Save frame with the video name in the filename
-            frame_name = f"{video_name}_img{i:04d}.png"
-            # Save to the specific folder for this video
+            frame_name = f"{video_name}_img{i:04d}{writer.ext}"
+            # Encode once into the video folder and link it into the total frames folder
             if subfolder:
-                cv2.imwrite(os.path.join(save_folder, frame_name), frame)
-                # print(f"Frames from video '{video_name}' have been saved to '{save_folder}'.")
+                writer.submit(frame, os.path.join(save_folder, frame_name),
+                              [os.path.join(total_frames_folder, frame_name)], key=i)
+            else:
+                writer.submit(frame, os.path.join(total_frames_folder, frame_name), key=i)
+            journal.update(writer.completed[journaled:])
+            journaled = len(writer.completed)
 
-            # Additionally, save to the total frames folder if applicable
-            if total_frames_folder:
-                cv2.imwrite(os.path.join(total_frames_folder, frame_name), frame)
+    cap.close()
+    if journal is not None:
+        journal.update(writer.completed[journaled:])
+        journal.finish()
+    frame_counter = len(writer) if frame_store else writer.stats["written"]
+    encode_seconds = 0.0 if frame_store else writer.stats["encode_seconds"]
+    bytes_written = len(writer) * writer.frame_bytes if frame_store else writer.stats["bytes"]
 
-            frame_counter += 1
+    stats = {
+        "video": video_name,
+        "total_frames": total_frames,
+        "frames_written": frame_counter,
+        "decoded": read_stats["decoded"],
+        "seeks": read_stats["seeks"],
+        "decoded_exact": read_stats["decoded_exact"],
+        "duplicates": duplicates,
+        "seconds": time.perf_counter() - start_time,
+        "encode_seconds": encode_seconds,
+        "bytes_written": bytes_written,
+        # Bytes read for the selection and the extraction, as measured by the reader (None with OpenCV)
+        "bytes_read": cap.bytes_read,
+        "video_bytes": os.path.getsize(video_path),
+        "reused": len(completed),
+    }
+    if hash_index is not None:
+        stats["hashes"] = np.array(hash_index.hashes[num_known:])
+    if transform is not None:
+        stats["transform"] = transform
+    if messages:
+        stats["messages"] = messages
+    return stats
 
-        cap.release()
 
-    if total_frames_folder:
-        print(f"All frames have also been saved to the total frames folder '{total_frames_folder}'.")
+def crop_and_scale(frame, crop=None, scale=1.0):
+    """
+    Cut the (x1, x2, y1, y2) box out of a frame and resize it by `scale` (area interpolation).
+    """
+    import cv2
+
+    if crop is not None:
+        x1, x2, y1, y2 = crop
+        frame = frame[y1:y2, x1:x2]
+    if scale != 1:
+        height, width = frame.shape[:2]
+        size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    return frame
 
-def kmeans_frame_selection(cap, num_frames, resize_width=30, batch_size=100, max_iter=50):
+
+def load_crop_config(config_path):
     """
-    Select key frames with distinct features using the K-means clustering method.
+    Crop boxes of a DeepLabCut project: {video name: (x1, x2, y1, y2)}.
+
+    The box of a video comes from its "crop" entry in `video_sets`. When `cropping` is enabled, the
+    project-wide x1/x2/y1/y2 are returned under the key None instead and apply to every video.
+    """
+    import yaml
+
+    with open(config_path, 'r') as f:
+        cfg = yaml.safe_load(f)
+    crops = {}
+    for video, settings in (cfg.get("video_sets") or {}).items():
+        if settings and settings.get("crop"):
+            name = os.path.splitext(os.path.basename(video))[0]
+            crops[name] = tuple(int(v) for v in str(settings["crop"]).split(","))
+    if cfg.get("cropping"):
+        return {None: tuple(int(cfg[key]) for key in ("x1", "x2", "y1", "y2"))}
+    return crops
+
+
+def save_transforms(path, transforms):
+    """
+    Merge the per-video transforms of a run into the transforms file. The frames of a video are
+    merged when its crop and scale are unchanged, and replaced otherwise.
+    """
+    existing = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            existing = json.load(f)
+    for video, transform in transforms.items():
+        previous = existing.get(video)
+        if previous and previous["crop"] == transform["crop"] and previous["scale"] == transform["scale"]:
+            # A resumed or incremental run adds to the frames of the earlier one
+            transform = dict(transform, frames=sorted(set(previous["frames"]) | set(transform["frames"])))
+        existing[video] = transform
+    with open(path + ".tmp", 'w') as f:
+        json.dump(existing, f)
+    os.replace(path + ".tmp", path)
+
+
+def to_original_coordinates(points, transform):
+    """
+    Map (x, y) points of a cropped and scaled frame back to the original video frame.
+
+    Args:
+        points (array-like): Points of shape (..., 2) in the saved frame.
+        transform (dict): Entry of a video in 'frame_transforms.json'.
+
+    Returns:
+        np.ndarray: The points in original frame coordinates.
+    """
+    x1, _, y1, _ = transform["crop"]
+    scale_x, scale_y = transform["scale"]
+    points = np.asarray(points, dtype=np.float64)
+    return points / np.array([scale_x, scale_y]) + np.array([x1, y1])
+
+
+def _frame_budget(total_frames, frame_number, percentage):
+    """Number of frames to select from a video of `total_frames` frames."""
+    if frame_number is not None:
+        return min(frame_number, total_frames)
+    return int(total_frames * (percentage / 100))
+
+
+def _journal_path(output_folder, video_path):
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(output_folder or ".", JOURNAL_FOLDER, video_name + ".json")
+
+
+def _extraction_key(video_path, options, crop, global_videos=None):
+    """
+    Journal key of a video for the `_extract_video` options (see `journal_key`). With `global_videos`, the
+    key also covers the videos and the total budget of the joint global K-means selection.
+    """
+    settings = {name: options[name] for name in JOURNAL_OPTIONS}
+    settings.update(crop=crop, output_folder=os.path.abspath(options["output_folder"] or "."))
+    if global_videos is not None:
+        settings.update(videos=sorted(os.path.abspath(v) for v in global_videos),
+                        frame_number=options["frame_number"], percentage=options["percentage"])
+    return journal_key(video_path, settings)
+
+
+def _finished_stats(video_path, total_frames, journal):
+    """Stats of a video that an earlier run finished with the same options, reported without opening it."""
+    return {
+        "video": os.path.splitext(os.path.basename(video_path))[0],
+        "total_frames": total_frames,
+        "frames_written": 0,
+        "decoded": 0,
+        "seeks": 0,
+        "decoded_exact": True,
+        "duplicates": 0,
+        "seconds": 0.0,
+        "encode_seconds": 0.0,
+        "bytes_written": 0,
+        "bytes_read": 0,
+        "video_bytes": os.path.getsize(video_path),
+        "reused": len(journal.completed),
+    }
+
+
+def _encode_summary(frames, encode_seconds, bytes_written):
+    """Per-frame encode time and size, appended to the progress lines."""
+    if not frames:
+        return ""
+    return (f", encode {1000 * encode_seconds / frames:.1f} ms/frame, "
+            f"{bytes_written / frames / 1024:.1f} KB/frame")
+
+
+def read_frames(cap, frame_indices, seek_threshold=SEEK_THRESHOLD, stats=None):
+    """
+    Read the requested frames in one forward pass, seeking only across large gaps.
+
+    Args:
+        cap (VideoReader or cv2.VideoCapture): Video to read from (see `dataprep.video_reader`).
+        frame_indices (Iterable[int]): Frame indices to read.
+        seek_threshold (int): Gap above which the reader seeks instead of decoding forward.
+        stats (dict, optional): Filled with the number of frames "decoded", "kept" and "seeks".
+
+    Yields:
+        Tuple[int, np.ndarray]: Frame index and BGR frame, in ascending index order.
+    """
+    return as_reader(cap).read(frame_indices, seek_threshold, stats)
+
+
+@staged("motion_frame_selection")
+def motion_frame_selection(cap, num_frames, metric="diff", step=1, resize_width=32, bins=32, smooth=5,
+                           seek_threshold=SEEK_THRESHOLD, show_progress=True, chunk_size=256):
+    """
+    Select frames at motion peaks or scene changes, scored in a single decoding pass.
+
+    Every `step`-th frame is downscaled to grayscale and compared with the previous one, a chunk of
+    frames at a time with NumPy. The frames with the highest (smoothed) score are then picked greedily,
+    keeping a minimum distance between picks so one event does not use up the whole budget.
 
     Args:
-        cap (cv2.VideoCapture): Video capture object.
+        cap (VideoReader or cv2.VideoCapture): Video to read from (see `dataprep.video_reader`).
         num_frames (int): Number of frames to select.
-        resize_width (int): Resize the frame width to reduce computational cost.
-        batch_size (int): Batch size for K-means processing.
-        max_iter (int): Maximum iterations for K-means.
+        metric (str): "diff" for the mean absolute pixel difference (motion energy), or "hist" for the
+            total variation distance between grayscale histograms (scene changes, robust to small motion).
+        step (int): Score every `step`-th frame.
+        resize_width (int): Frames are resized to `resize_width` x `resize_width` pixels before scoring.
+        bins (int): Number of histogram bins for the "hist" metric.
+        smooth (int): Length of the moving average applied to the scores (1 disables smoothing).
+        seek_threshold (int): Gap between frames above which the reader seeks.
+        show_progress (bool): Whether to show a progress bar while decoding.
+        chunk_size (int): Number of downscaled frames scored together.
 
     Returns:
         List[int]: Indices of the selected frames.
     """
+    import cv2
+    from tqdm import tqdm
+
+    if metric not in ("diff", "hist"):
+        raise ValueError(f"Unknown motion metric: {metric}")
+
+    reader = as_reader(cap)
+    total_frames = reader.frame_count
+    frame_indices = np.arange(0, total_frames, max(1, step))
+    if num_frames <= 0 or len(frame_indices) == 0:
+        return []
+
+    valid_indices = np.empty(len(frame_indices), dtype=np.int64)
+    scores = np.zeros(len(frame_indices), dtype=np.float32)
+    chunk = np.empty((chunk_size + 1, resize_width * resize_width), dtype=np.uint8)
+    count = 0
+    filled = 0  # rows of `chunk` in use; row 0 carries the last frame of the previous chunk
+
+    def score_chunk(rows):
+        if metric == "diff":
+            return np.abs(np.diff(rows.astype(np.int16), axis=0)).mean(axis=1)
+        # Histograms of all rows at once, via offset bin indices per row
+        binned = (rows.astype(np.int32) * bins) >> 8
+        binned += (np.arange(len(rows)) * bins)[:, None]
+        hist = np.bincount(binned.ravel(), minlength=len(rows) * bins).reshape(len(rows), bins)
+        hist = hist / rows.shape[1]
+        return 0.5 * np.abs(np.diff(hist, axis=0)).sum(axis=1)
+
+    read_stats = {}
+    frames = reader.read(frame_indices, seek_threshold, read_stats)
+    for i, frame in tqdm(frames, total=len(frame_indices), desc="Scoring motion", disable=not show_progress):
+        small = cv2.resize(frame, (resize_width, resize_width), interpolation=cv2.INTER_AREA)
+        chunk[filled] = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).ravel()
+        valid_indices[count] = i
+        count += 1
+        filled += 1
+        if filled == len(chunk):
+            scores[count - filled + 1:count] = score_chunk(chunk[:filled])
+            chunk[0] = chunk[filled - 1]
+            filled = 1
+    if filled > 1:
+        scores[count - filled + 1:count] = score_chunk(chunk[:filled])
+    current_stage().update(_read_counters(read_stats))
 
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_indices = np.linspace(0, total_frames - 1, num=min(1000, total_frames), dtype=int)
+    valid_indices = valid_indices[:count]
+    scores = scores[:count]
+    if count <= num_frames:
+        return valid_indices.tolist()
 
-    feature_vectors = []
-    valid_indices = []
-    for i in tqdm(frame_indices, desc="Extracting frames for K-means clustering"):
-        cap.set(cv2.CAP_PROP_POS_FRAMES, i)
-        ret, frame = cap.read()
-        if not ret:
+    # Rank events on the smoothed scores, then keep the sharpest frame around each peak
+    ranking = scores
+    if smooth > 1:
+        ranking = np.convolve(scores, np.ones(smooth, dtype=np.float32) / smooth, mode="same")
+    half = smooth // 2
+
+    # Greedy non-maximum suppression over the sorted scores
+    min_gap = max(0, count // (2 * num_frames))
+    blocked = np.zeros(count, dtype=bool)
+    selected = []
+    for row in np.argsort(-ranking, kind="stable"):
+        if blocked[row]:
+            continue
+        low = max(0, row - half)
+        row = low + int(np.argmax(scores[low:row + half + 1]))
+        if blocked[row]:
             continue
+        selected.append(row)
+        if len(selected) == num_frames:
+            break
+        blocked[max(0, row - min_gap):row + min_gap + 1] = True
+
+    if len(selected) < num_frames:
+        rest = np.setdiff1d(np.argsort(-ranking, kind="stable"), selected, assume_unique=True)
+        selected.extend(rest[:num_frames - len(selected)].tolist())
+
+    return sorted(valid_indices[selected].tolist())
+
+
+@staged("kmeans_frame_selection")
+def kmeans_frame_selection(cap, num_frames, resize_width=30, batch_size=100, max_iter=50,
+                           seek_threshold=SEEK_THRESHOLD, show_progress=True, streaming=False, step=1,
+                           video_path=None, cache_dir=None, memmap_bytes=MEMMAP_BYTES, messages=None):
+    """
+    Select key frames with distinct features using the K-means clustering method.
+
+    By default up to 1000 evenly spaced frames are clustered. With `streaming`, every `step`-th
+    frame of the whole video is decoded in one pass instead. In both cases the features are
+    clustered with `MiniBatchKMeans.partial_fit` in batches, and the frame closest to each
+    centroid is selected.
+
+    Args:
+        cap (VideoReader or cv2.VideoCapture): Video to read from (see `dataprep.video_reader`).
+        num_frames (int): Number of frames to select.
+        resize_width (int): Resize the frame width to reduce computational cost.
+        batch_size (int): Batch size for K-means processing.
+        max_iter (int): Minimum number of K-means batch updates; at least one full pass is made.
+        seek_threshold (int): Gap between sampled frames above which the reader seeks.
+        show_progress (bool): Whether to show a progress bar while sampling frames.
+        streaming (bool): Cluster every `step`-th frame of the video instead of 1000 samples.
+        step (int): Sampling step of the streaming mode.
+        video_path (str, optional): Path of the video behind `cap`. Required for caching.
+        cache_dir (str, optional): Folder to cache the features in (see `load_frame_features`).
+        memmap_bytes (int): Feature matrices larger than this are kept in a memmap on disk.
+        messages (list, optional): Collects the status and warning messages instead of printing them, so
+            the caller can write them without breaking its progress bar (e.g. from a worker process).
 
-        frame_resized = cv2.resize(frame, (resize_width, resize_width))
-        gray = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2GRAY)
-        feature_vectors.append(gray.flatten())
-        valid_indices.append(i)
+    Returns:
+        List[int]: Indices of the selected frames.
+    """
+    if num_frames <= 0:
+        return []
+    log = print if messages is None else messages.append
 
-    if len(feature_vectors) < num_frames:
-        print(f"Warning: Not enough frames for K-means. Returning all {len(feature_vectors)} frames.")
-        return sorted(valid_indices)
+    reader = as_reader(cap)
+    frame_indices = _kmeans_sample_indices(reader.frame_count, streaming, step)
 
-    print("Performing K-means clustering...")
+    read_stats = {}
+    valid_indices, features = load_frame_features(reader, frame_indices, resize_width, seek_threshold, video_path,
+                                                  cache_dir, memmap_bytes, show_progress, stats=read_stats)
+    metrics = current_stage()
+    metrics.update(video=video_path, frames_sampled=len(frame_indices), frames_valid=len(valid_indices),
+                   feature_bytes=features.nbytes, **_read_counters(read_stats))
 
-    num_clusters = min(num_frames, len(feature_vectors))
-    if num_clusters < num_frames:
-        print(f"Warning: Not enough distinct frames for {num_frames} clusters. Using {num_clusters} clusters instead.")
+    if len(valid_indices) < num_frames:
+        log(f"Warning: Not enough frames for K-means. Returning all {len(valid_indices)} frames.")
+        return sorted(valid_indices.tolist())
 
-    kmeans = MiniBatchKMeans(n_clusters=num_clusters, batch_size=batch_size, max_iter=max_iter, random_state=42)
-    kmeans.fit(feature_vectors)
+    log("Performing K-means clustering...")
 
-    selected_frames = []
-    for cluster_id in range(num_clusters):
-        cluster_indices = np.where(kmeans.labels_ == cluster_id)[0]
-        if len(cluster_indices) > 0:
-            selected_frames.append(valid_indices[random.choice(cluster_indices)])
+    num_clusters = min(num_frames, len(valid_indices))
+    with stage("kmeans_clustering", clusters=num_clusters, frames=len(valid_indices)):
+        closest = cluster_closest_frames(features, num_clusters, batch_size, max_iter)
+    selected_frames = sorted(set(valid_indices[closest].tolist()))
+    metrics["distinct_centers"] = len(selected_frames)
 
     if len(selected_frames) < num_frames:
-        print(f"Warning: Only {len(selected_frames)} clusters found, adding extra frames.")
-        remaining_indices = list(set(valid_indices) - set(selected_frames))
-        random.shuffle(remaining_indices)
-        selected_frames.extend(remaining_indices[:num_frames - len(selected_frames)])
+        log(f"Warning: Only {len(selected_frames)} distinct cluster centers found, adding extra frames.")
+        remaining_indices = np.setdiff1d(valid_indices, selected_frames)
+        np.random.RandomState(42).shuffle(remaining_indices)
+        selected_frames.extend(remaining_indices[:num_frames - len(selected_frames)].tolist())
 
     return sorted(selected_frames)
+
+
+@staged("global_kmeans_frame_selection")
+def global_kmeans_frame_selection(video_paths, num_frames=None, percentage=None, resize_width=30, batch_size=100,
+                                  max_iter=50, seek_threshold=SEEK_THRESHOLD, streaming=False, step=1,
+                                  cache_dir=None, workers=1, video_frames=None, decode_backend="opencv",
+                                  decode_threads=0):
+    """
+    Select key frames across several videos with a single K-means clustering.
+
+    Features of all videos are extracted in parallel (one process per video), written to the feature
+    cache and pooled into one on-disk matrix, so near-identical views from different videos share
+    clusters instead of each video getting its own budget. Peak memory stays at about one batch.
+
+    Args:
+        video_paths (List[str]): Paths of the videos.
+        num_frames (int, optional): Total number of frames to select over all videos.
+        percentage (int, optional): Percentage (0-100) of all frames to select. Used if num_frames is None.
+        resize_width (int): Resize the frame width to reduce computational cost.
+        batch_size (int): Batch size for K-means processing.
+        max_iter (int): Minimum number of K-means batch updates; at least one full pass is made.
+        seek_threshold (int): Gap between sampled frames above which the reader seeks.
+        streaming (bool): Cluster every `step`-th frame of each video instead of 1000 samples per video.
+        step (int): Sampling step of the streaming mode.
+        cache_dir (str, optional): Folder of the feature cache. A temporary folder is used if None.
+        workers (int): Number of processes extracting features in parallel.
+        video_frames (dict, optional): {video path: frame count}, e.g. from `probe_videos`. Probed if None.
+        decode_backend (str): Decode backend of the feature extraction (see `dataprep.video_reader`).
+        decode_threads (int): Decoding threads per video with PyAV; 0 lets FFmpeg choose.
+
+    Returns:
+        List[Tuple[str, int]]: Selected (video path, frame index) pairs, sorted.
+    """
+    from tqdm import tqdm
+
+    if video_frames is None:
+        video_frames = {v: meta["frames"] if meta else 0 for v, meta in probe_videos(video_paths).items()}
+    if num_frames is None:
+        num_frames = int(sum(video_frames[v] for v in video_paths) * (percentage / 100))
+    if num_frames <= 0:
+        return []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_dir = cache_dir or temp_dir
+        args = [(video_path, video_frames[video_path], resize_width, seek_threshold, streaming, step, cache_dir,
+                 decode_backend, decode_threads) for video_path in video_paths]
+        if workers > 1 and len(video_paths) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(video_paths))) as pool:
+                sampled = list(tqdm(pool.map(_cache_video_features, *zip(*args)), total=len(args),
+                                    desc="Extracting features for K-means clustering", unit="video"))
+        else:
+            sampled = [_cache_video_features(*a) for a in tqdm(
+                args, desc="Extracting features for K-means clustering", unit="video")]
+
+        metrics = current_stage()
+        for _, _, _, counters in sampled:
+            for key, value in counters.items():
+                metrics.add(key, value)
+        counts = [len(valid) for _, _, valid, _ in sampled]
+        total_rows = sum(counts)
+        if total_rows <= num_frames:
+            print(f"Warning: Not enough frames for K-means. Returning all {total_rows} frames.")
+            return [(video_path, int(i)) for video_path, (_, _, valid, _) in zip(video_paths, sampled) for i in valid]
+
+        # Pool the per-video features into one matrix on disk
+        features = np.lib.format.open_memmap(os.path.join(temp_dir, "pooled_features.npy"), mode="w+",
+                                             dtype=np.uint8, shape=(total_rows, resize_width * resize_width))
+        owners = np.repeat(np.arange(len(video_paths)), counts)
+        frame_of_row = np.empty(total_rows, dtype=np.int64)
+        row = 0
+        for video_path, (_, indices, valid, _) in zip(video_paths, sampled):
+            cache_path = _feature_cache_path(video_path, indices, resize_width, cache_dir,
+                                             resolve_backend(decode_backend))
+            features[row:row + len(valid)] = _load_cached_features(cache_path)[1]
+            frame_of_row[row:row + len(valid)] = valid
+            row += len(valid)
+
+        print(f"Performing K-means clustering on {total_rows} frames from {len(video_paths)} videos...")
+        closest = np.unique(cluster_closest_frames(features, num_frames, batch_size, max_iter))
+        if len(closest) < num_frames:
+            print(f"Warning: Only {len(closest)} distinct cluster centers found, adding extra frames.")
+            remaining = np.setdiff1d(np.arange(total_rows), closest)
+            np.random.RandomState(42).shuffle(remaining)
+            closest = np.concatenate([closest, remaining[:num_frames - len(closest)]])
+
+        selected = sorted((video_paths[owners[r]], int(frame_of_row[r])) for r in closest)
+        del features
+    return selected
+
+
+def _cache_video_features(video_path, total_frames, resize_width, seek_threshold, streaming, step, cache_dir,
+                          decode_backend="opencv", decode_threads=0):
+    """
+    Write the K-means features of one video to the cache. Runs in a worker process; the video is
+    only opened if its features are not cached yet.
+
+    Returns:
+        Tuple[int, np.ndarray, np.ndarray, dict]: Frame count, sampled indices, indices actually read and
+        the read counters (see `_read_counters`).
+    """
+    frame_indices = _kmeans_sample_indices(total_frames, streaming, step)
+    read_stats = {}
+    valid_indices, _ = load_frame_features(None, frame_indices, resize_width, seek_threshold, video_path, cache_dir,
+                                           show_progress=False, decode_backend=decode_backend,
+                                           decode_threads=decode_threads, stats=read_stats)
+    return total_frames, frame_indices, valid_indices, _read_counters(read_stats)
+
+
+def _read_counters(read_stats):
+    """Counters of a `VideoReader.read` for a stage record: frames "decoded" and "kept", "seeks" and "bytes_read"."""
+    return {key: read_stats[key] for key in ("decoded", "kept", "seeks", "bytes_read") if key in read_stats}
+
+
+def _kmeans_sample_indices(total_frames, streaming=False, step=1):
+    """Frames fed to K-means: every `step`-th frame when streaming, otherwise up to 1000 evenly spaced ones."""
+    if streaming:
+        return np.arange(0, total_frames, max(1, step))
+    return np.linspace(0, total_frames - 1, num=min(1000, total_frames), dtype=np.int64)
+
+
+def cluster_closest_frames(features, num_clusters, batch_size=100, max_iter=50, random_state=42):
+    """
+    Cluster uint8 feature rows with `MiniBatchKMeans.partial_fit` and find the row closest to each centroid.
+
+    Rows are converted to float one batch at a time, so `features` may be a memmap larger than memory.
+
+    Args:
+        features (np.ndarray): Feature matrix of shape (n_frames, n_features), typically uint8.
+        num_clusters (int): Number of clusters.
+        batch_size (int): Rows per `partial_fit` call (raised to `num_clusters` if smaller).
+        max_iter (int): Minimum number of batch updates; at least one full pass is made.
+        random_state (int): Seed of the clustering and of the batch order.
+
+    Returns:
+        np.ndarray: Row index of the frame closest to each centroid, one per cluster.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    n = len(features)
+    batch_size = max(batch_size, num_clusters)
+    kmeans = MiniBatchKMeans(n_clusters=num_clusters, batch_size=batch_size, random_state=random_state)
+
+    rng = np.random.RandomState(random_state)
+    starts = np.arange(0, n, batch_size)
+    num_updates = max(len(starts), max_iter)
+    order = np.concatenate([rng.permutation(starts) for _ in range(-(-num_updates // len(starts)))])
+    # The first batch initialises the centroids and must hold at least num_clusters rows
+    first = rng.choice(n, size=min(n, max(batch_size, 3 * num_clusters)), replace=False)
+    kmeans.partial_fit(features[np.sort(first)].astype(np.float32))
+    for start in order[:num_updates]:
+        batch = features[start:start + batch_size].astype(np.float32)
+        if len(batch):
+            kmeans.partial_fit(batch)
+
+    best_distance = np.full(num_clusters, np.inf)
+    closest = np.zeros(num_clusters, dtype=np.int64)
+    for start in range(0, n, batch_size):
+        distances = kmeans.transform(features[start:start + batch_size].astype(np.float32))
+        rows = distances.argmin(axis=0)
+        values = distances[rows, np.arange(num_clusters)]
+        better = values < best_distance
+        best_distance[better] = values[better]
+        closest[better] = rows[better] + start
+    return closest
+
+
+def load_frame_features(cap, frame_indices, resize_width=30, seek_threshold=SEEK_THRESHOLD, video_path=None,
+                        cache_dir=None, memmap_bytes=MEMMAP_BYTES, show_progress=True, decode_backend="opencv",
+                        decode_threads=0, stats=None):
+    """
+    Decode the given frames once into a preallocated uint8 matrix of downscaled grayscale pixels.
+
+    Frames are read through the reduced-resolution path of the reader (`size`), so with PyAV they are
+    scaled and converted to gray straight from the decoded picture.
+
+    With `cache_dir` and `video_path`, the matrix is stored as .npy files keyed by the video path,
+    size and modification time, the frame indices, `resize_width` and the decode backend, and later
+    calls load it as a read-only memmap instead of decoding the video again.
+
+    Args:
+        cap (VideoReader or cv2.VideoCapture): Video to read from, or None to open `video_path` with
+            `decode_backend` only if needed.
+        frame_indices (np.ndarray): Sorted frame indices to decode.
+        resize_width (int): Frames are resized to `resize_width` x `resize_width` pixels.
+        seek_threshold (int): Gap between frames above which the reader seeks.
+        video_path (str, optional): Path of the video behind `cap`. Required for caching.
+        cache_dir (str, optional): Folder of the feature cache. None disables caching.
+        memmap_bytes (int): Uncached matrices larger than this are kept in a temporary memmap.
+        show_progress (bool): Whether to show a progress bar while decoding.
+        decode_backend (str): Backend used to open `video_path` when `cap` is None.
+        decode_threads (int): Decoding threads with PyAV; 0 lets FFmpeg choose.
+        stats (dict, optional): Filled with the read counters of the reader (see `VideoReader.read`); left
+            empty when the features come from the cache.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Indices of the frames that could be read, and their
+        features with shape (len(indices), resize_width ** 2).
+    """
+    from tqdm import tqdm
+
+    frame_indices = np.asarray(frame_indices, dtype=np.int64)
+    shape = (len(frame_indices), resize_width * resize_width)
+    reader = None if cap is None else as_reader(cap)
+
+    cache_path = None
+    if cache_dir and video_path:
+        backend = reader.backend if reader is not None else resolve_backend(decode_backend)
+        cache_path = _feature_cache_path(video_path, frame_indices, resize_width, cache_dir, backend)
+        if os.path.exists(cache_path + "_indices.npy"):
+            current_stage().add("feature_cache_hits")
+            return _load_cached_features(cache_path)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    temp_file = None
+    if cache_path:
+        features = np.lib.format.open_memmap(cache_path + "_features.tmp.npy", mode="w+", dtype=np.uint8,
+                                             shape=shape)
+    elif shape[0] * shape[1] > memmap_bytes:
+        temp_file = tempfile.TemporaryFile()
+        features = np.memmap(temp_file, dtype=np.uint8, mode="w+", shape=shape)
+    else:
+        features = np.empty(shape, dtype=np.uint8)
+
+    own_reader = reader is None
+    if own_reader:
+        reader = open_video(video_path, decode_backend, decode_threads)
+
+    valid_indices = np.empty(len(frame_indices), dtype=np.int64)
+    count = 0
+    frames = reader.read(frame_indices, seek_threshold, stats, size=(resize_width, resize_width))
+    for i, frame in tqdm(frames, total=len(frame_indices), desc="Extracting frames for K-means clustering",
+                         disable=not show_progress):
+        features[count] = frame.ravel()
+        valid_indices[count] = i
+        count += 1
+    valid_indices = valid_indices[:count]
+    if own_reader:
+        reader.close()
+
+    if cache_path:
+        features.flush()
+        del features
+        os.replace(cache_path + "_features.tmp.npy", cache_path + "_features.npy")
+        # The indices file marks the cache entry as complete, so it is written last
+        np.save(cache_path + "_indices.tmp.npy", valid_indices)
+        os.replace(cache_path + "_indices.tmp.npy", cache_path + "_indices.npy")
+        features = np.load(cache_path + "_features.npy", mmap_mode="r")
+
+    return valid_indices, features[:count]
+
+
+def _feature_cache_path(video_path, frame_indices, resize_width, cache_dir, backend="opencv"):
+    """Cache file prefix for the features of `frame_indices`, keyed by the video path, size and mtime."""
+    stat = os.stat(video_path)
+    # Entries of the OpenCV backend keep the key they had before the backend was part of it
+    suffix = "" if backend == "opencv" else f"|{backend}"
+    key = hashlib.sha1(
+        f"{os.path.abspath(video_path)}|{stat.st_size}|{stat.st_mtime_ns}|{resize_width}{suffix}".encode()
+        + np.asarray(frame_indices, dtype=np.int64).tobytes()
+    ).hexdigest()[:16]
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(cache_dir, f"{video_name}_{key}")
+
+
+def _load_cached_features(cache_path):
+    """Load cached frame indices and a read-only memmap of their features."""
+    valid_indices = np.load(cache_path + "_indices.npy")
+    features = np.load(cache_path + "_features.npy", mmap_mode="r")
+    return valid_indices, features[:len(valid_indices)]
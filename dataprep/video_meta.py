@@ -0,0 +1,118 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+METADATA_FILE = ".video_metadata.json"
+
+
+def probe_video(video_path):
+    """
+    Read the frame count, frame rate, resolution and bounding box of a video.
+
+    The bounding box is the full frame as "x1, x2, y1, y2", like DeepLabCut's `VideoReader.get_bbox()`.
+
+    Args:
+        video_path (str): Path of the video.
+
+    Returns:
+        dict: "frames", "fps", "width", "height" and "bbox" of the video.
+    """
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video file {video_path}")
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    meta = {
+        "frames": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        "fps": float(cap.get(cv2.CAP_PROP_FPS)),
+        "width": width,
+        "height": height,
+        "bbox": [0, width, 0, height],
+    }
+    cap.release()
+    return meta
+
+
+class VideoMetadataCache:
+    """
+    Sidecar JSON cache of `probe_video` results, keyed by absolute path and validated by size and mtime.
+
+    Args:
+        path (str): Path of the cache file, usually `METADATA_FILE` in the video folder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                print(f"Warning: Ignoring unreadable video metadata cache {path}")
+
+    @staticmethod
+    def _key(video_path):
+        stat = os.stat(video_path)
+        return os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns
+
+    def get(self, video_path):
+        """Metadata of `video_path`, probing the file only if it is new or has changed."""
+        key, size, mtime = self._key(video_path)
+        entry = self._entries.get(key)
+        if entry and entry["size"] == size and entry["mtime_ns"] == mtime:
+            return entry["meta"]
+        meta = probe_video(video_path)
+        with self._lock:
+            self._entries[key] = {"size": size, "mtime_ns": mtime, "meta": meta}
+            self._dirty = True
+        return meta
+
+    def save(self):
+        """
+        Write the cache if anything was probed, via a temporary file so readers never see a partial file.
+        A folder that cannot be written (e.g. a read-only mount of the recordings) only gives a warning.
+        """
+        if not self._dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Warning: Cannot write video metadata cache {self.path}: {e}")
+            return
+        self._dirty = False
+
+
+def probe_videos(video_paths, cache_path=None, workers=8):
+    """
+    Get the metadata of several videos, probing the ones not in the cache on a thread pool.
+
+    Args:
+        video_paths (List[str]): Paths of the videos.
+        cache_path (str, optional): Sidecar cache file. None probes every video without caching.
+        workers (int): Number of threads opening videos concurrently.
+
+    Returns:
+        dict: {video path: metadata, or None when the video cannot be opened}.
+    """
+    cache = VideoMetadataCache(cache_path) if cache_path else None
+
+    def probe(video_path):
+        try:
+            return cache.get(video_path) if cache else probe_video(video_path)
+        except IOError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = dict(zip(video_paths, pool.map(probe, video_paths)))
+    if cache:
+        cache.save()
+    return results
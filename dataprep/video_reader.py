@@ -0,0 +1,417 @@
+import importlib.util
+
+# Gap (in frames) above which seeking is cheaper than grabbing forward. Roughly one GOP of
+# a typical H.264 recording: a seek re-decodes from the previous keyframe anyway.
+SEEK_THRESHOLD = 250
+
+DECODE_BACKENDS = ("auto", "opencv", "pyav")
+
+
+def resolve_backend(backend="opencv"):
+    """
+    Name of the decode backend to use. "auto" picks "pyav" when PyAV is installed (multithreaded
+    decoding), otherwise "opencv".
+    """
+    if backend not in DECODE_BACKENDS:
+        raise ValueError(f"Unknown decode backend: {backend}")
+    if backend == "auto":
+        return "pyav" if importlib.util.find_spec("av") is not None else "opencv"
+    return backend
+
+
+def open_video(video_path, backend="opencv", threads=0):
+    """
+    Open a video with the given decode backend.
+
+    Args:
+        video_path (str): Path of the video.
+        backend (str): "opencv", "pyav" or "auto" (see `resolve_backend`).
+        threads (int): Decoding threads of the PyAV backend; 0 lets FFmpeg pick one per core.
+
+    Returns:
+        VideoReader: An open reader; close it with `close` or use it as a context manager.
+    """
+    if resolve_backend(backend) == "pyav":
+        return PyAVReader(video_path, threads)
+    return OpenCVReader(video_path)
+
+
+def as_reader(cap):
+    """Wrap a `cv2.VideoCapture` in an `OpenCVReader`; readers are returned unchanged."""
+    return cap if isinstance(cap, VideoReader) else OpenCVReader(capture=cap)
+
+
+def frame_timestamps(video_path):
+    """
+    Presentation timestamps of the frames of a video, in display order, read from the demuxed packets
+    without decoding them (requires PyAV). Frame i is the one with the i-th timestamp, as counted by a
+    sequential read, also when the frame rate varies or frames are reordered (B-frames).
+
+    Args:
+        video_path (str or file): Path of the video, or a binary file object opened on it.
+
+    Returns:
+        List[int] or None: Timestamps in units of the stream's time base, or None when the video cannot
+        be demuxed or a packet has no timestamp, so frames cannot be located by it.
+    """
+    import av
+
+    timestamps = []
+    try:
+        with av.open(video_path) as container:
+            for packet in container.demux(container.streams.video[0]):
+                if packet.size == 0 or packet.is_discard:
+                    # Flush packet at the end of the stream, or dropped by the decoder (edit lists)
+                    continue
+                if packet.pts is None:
+                    return None
+                timestamps.append(packet.pts)
+    except (av.error.FFmpegError, IndexError):
+        return None
+    return sorted(timestamps)
+
+
+def is_constant_rate(timestamps, tolerance=1):
+    """Whether consecutive timestamps are evenly spaced, up to `tolerance` units of rounding."""
+    steps = [b - a for a, b in zip(timestamps, timestamps[1:])]
+    return not steps or max(steps) - min(steps) <= tolerance
+
+
+class CountingFile:
+    """Binary file that counts the bytes read through it, so `av.open` on it measures the I/O of a reader."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self._file.close()
+
+
+def plan_reads(frame_indices, seek_threshold=SEEK_THRESHOLD):
+    """
+    Group frame indices into runs that can each be read with a single forward sweep.
+
+    Consecutive indices closer than `seek_threshold` share a run and are reached by grabbing
+    forward; a larger gap starts a new run, which the reader reaches with one seek.
+
+    Args:
+        frame_indices (Iterable[int]): Frame indices to read, in any order.
+        seek_threshold (int): Largest gap (in frames) that is still decoded through.
+
+    Returns:
+        List[List[int]]: Sorted, de-duplicated runs of frame indices.
+    """
+    runs = []
+    for i in sorted(set(frame_indices)):
+        if runs and i - runs[-1][-1] <= seek_threshold:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    return runs
+
+
+class VideoReader:
+    """
+    Reads selected frames of a video, decoding forward through small gaps and seeking across large
+    ones (see `plan_reads`). Subclasses implement `frame_count`, `_read_runs` and `close`.
+    """
+
+    backend = None
+    # Whether "decoded" includes the frames decoded from the keyframe inside a seek
+    decoded_exact = True
+    # Bytes read from the video file since it was opened, or None when the backend cannot measure it
+    bytes_read = None
+
+    @property
+    def frame_count(self):
+        raise NotImplementedError
+
+    def read(self, frame_indices, seek_threshold=SEEK_THRESHOLD, stats=None, size=None):
+        """
+        Read the requested frames in one forward pass, seeking only across large gaps.
+
+        Args:
+            frame_indices (Iterable[int]): Frame indices to read.
+            seek_threshold (int): Gap above which the reader seeks instead of decoding forward.
+            stats (dict, optional): Filled with the number of frames "decoded", "kept" and "seeks", and
+                "decoded_exact": False when the backend decodes frames inside a seek that it cannot count
+                (OpenCV), so "decoded" is then a lower bound. Backends that measure their I/O (PyAV) also
+                fill "bytes_read" once the frames are consumed.
+            size (tuple, optional): (width, height) to get downscaled grayscale frames instead of
+                full BGR frames, e.g. for clustering features.
+
+        Yields:
+            Tuple[int, np.ndarray]: Frame index and frame, in ascending index order.
+        """
+        if stats is None:
+            stats = {}
+        stats.update(decoded=0, kept=0, seeks=0, decoded_exact=self.decoded_exact)
+        start = self.bytes_read
+        yield from self._read_runs(plan_reads(frame_indices, seek_threshold), seek_threshold, stats, size)
+        if start is not None:
+            stats["bytes_read"] = self.bytes_read - start
+
+    def _read_runs(self, runs, seek_threshold, stats, size):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class OpenCVReader(VideoReader):
+    """
+    Reader on `cv2.VideoCapture`. Frames between two requested indices are skipped with `grab()`
+    (decoded but not converted), and only the requested ones are converted with `retrieve()`.
+
+    After `cap.set(CAP_PROP_POS_FRAMES)`, OpenCV decodes from the previous keyframe up to the target
+    internally. Those frames cannot be observed, so "decoded" only counts the grabbed frames and
+    misses up to one keyframe interval per seek; compare decode work across backends with PyAV.
+
+    OpenCV converts frame numbers to timestamps with the average frame rate, so its seeks land on the
+    wrong frames when the rate varies. Before the first seek, the packet timestamps are checked with PyAV
+    (see `frame_timestamps`); a variable-rate video is then read forward only, going back to the first
+    frame when an earlier frame is requested. Without PyAV, or for a wrapped capture, the rate is assumed
+    constant.
+
+    Args:
+        video_path (str, optional): Video to open.
+        capture (cv2.VideoCapture, optional): Capture to read from instead; it is not released by `close`.
+    """
+
+    backend = "opencv"
+    decoded_exact = False
+
+    def __init__(self, video_path=None, capture=None):
+        import cv2
+
+        self.video_path = video_path
+        self._owned = capture is None
+        self.cap = cv2.VideoCapture(video_path) if capture is None else capture
+        # Counted here: CAP_PROP_POS_FRAMES is derived from timestamps as well
+        self._position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        self._seekable = None
+
+    @property
+    def frame_count(self):
+        import cv2
+
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def _can_seek(self):
+        """Whether `CAP_PROP_POS_FRAMES` lands on the requested frame, checked once (see the class docstring)."""
+        if self._seekable is None:
+            self._seekable = True
+            if self.video_path is not None and importlib.util.find_spec("av") is not None:
+                timestamps = frame_timestamps(self.video_path)
+                self._seekable = timestamps is not None and is_constant_rate(timestamps)
+        return self._seekable
+
+    def _read_runs(self, runs, seek_threshold, stats, size):
+        import cv2
+
+        cap = self.cap
+        for run in runs:
+            if run[0] < self._position or run[0] - self._position > seek_threshold:
+                if self._can_seek():
+                    target = run[0]
+                elif run[0] < self._position:
+                    # Only the first frame of a variable-rate video is reached exactly
+                    target = 0
+                else:
+                    target = None
+                if target is not None:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                    self._position = target
+                    stats["seeks"] += 1
+
+            for i in run:
+                ok = True
+                while ok and self._position <= i:
+                    ok = cap.grab()
+                    if ok:
+                        self._position += 1
+                        stats["decoded"] += 1
+                if not ok:
+                    # End of stream or a broken packet: let the next run seek past it
+                    break
+
+                ret, frame = cap.retrieve()
+                if not ret:
+                    continue
+                if size is not None:
+                    frame = cv2.cvtColor(cv2.resize(frame, size), cv2.COLOR_BGR2GRAY)
+                stats["kept"] += 1
+                yield i, frame
+
+    def close(self):
+        if self._owned:
+            self.cap.release()
+
+
+class PyAVReader(VideoReader):
+    """
+    Reader on PyAV (FFmpeg). Frames are decoded with frame and slice threading, so a single long
+    video uses several cores. Skipped frames are decoded but never converted, and with `size` the
+    kept ones are scaled and converted to gray in one swscale call, without building the
+    full-resolution BGR image.
+
+    Frames are numbered by counting them in decoding order from the first one, like a sequential
+    `cv2.VideoCapture.read()`. The first seek builds the table of packet timestamps (see
+    `frame_timestamps`): seeks go to the keyframe before the target's timestamp, and from then on each
+    frame is numbered by its position in the table, so variable frame rates and reordered frames keep
+    their indices. When the table cannot be built, the reader only decodes forward and goes back to
+    the first frame for earlier frames.
+
+    The file is read through a `CountingFile`, so `bytes_read` measures the I/O, including the table.
+
+    Args:
+        video_path (str): Video to open.
+        threads (int): Decoding threads; 0 lets FFmpeg pick one per core.
+    """
+
+    backend = "pyav"
+
+    def __init__(self, video_path, threads=0):
+        self.video_path = video_path
+        self.threads = threads
+        self._container = None
+        self._file = None
+        self._bytes_closed = 0  # bytes read through files closed since
+        self._timestamps = None  # packet timestamps in display order, built at the first seek
+        self._indices = None  # frame index of each timestamp
+        self._open()
+
+    def _open(self):
+        """Start decoding at the first frame, reopening the container."""
+        import av
+
+        if self._container is not None:
+            self.close()
+        self._file = CountingFile(self.video_path)
+        self._container = av.open(self._file)
+        self._stream = self._container.streams.video[0]
+        self._stream.thread_type = "AUTO"
+        self._stream.codec_context.thread_count = self.threads
+        self._frames = self._container.decode(self._stream)
+        self._position = 0  # index of the next frame from the decoder
+        self._pending = None  # a decoded frame past the one requested, kept for the next request
+
+    @property
+    def frame_count(self):
+        if self._stream.frames:
+            return self._stream.frames
+        return len(self._frame_table() or ())
+
+    @property
+    def bytes_read(self):
+        return self._bytes_closed + self._file.bytes_read
+
+    def _frame_table(self):
+        if self._indices is None:
+            file = CountingFile(self.video_path)
+            try:
+                self._timestamps = frame_timestamps(file) or []
+            finally:
+                file.close()
+                self._bytes_closed += file.bytes_read
+            self._indices = {ts: i for i, ts in enumerate(self._timestamps)}
+        return self._timestamps
+
+    def _seek(self, index):
+        """
+        Move the decoder to the keyframe at or before frame `index`, or back to the first frame when the
+        frames cannot be located by timestamp. Returns False, without moving, when the target is ahead and
+        cannot be located, so the caller decodes forward.
+        """
+        timestamps = self._frame_table()
+        if timestamps and index < len(timestamps):
+            self._container.seek(timestamps[index], stream=self._stream, backward=True, any_frame=False)
+            self._frames = self._container.decode(self._stream)
+            frame = self._decode()
+            start = self._indices.get(frame.pts) if frame is not None else None
+            if start is not None and start <= index:
+                self._pending = (start, frame)
+                self._position = start + 1
+                return True
+        elif index > self._position:
+            return False
+        # The seek landed past the target, or there is no table: decode from the start
+        self._open()
+        return True
+
+    def _decode(self):
+        """Next decoded frame, or None at the end of the stream or on a broken packet."""
+        import av
+
+        try:
+            return next(self._frames)
+        except (StopIteration, av.error.FFmpegError):
+            return None
+
+    def _next(self):
+        """Next decoded (index, frame), or None at the end of the stream or on a broken packet."""
+        if self._pending is not None:
+            item, self._pending = self._pending, None
+            return item
+        frame = self._decode()
+        if frame is None:
+            return None
+        index = self._position
+        if self._indices:
+            index = self._indices.get(frame.pts, index)
+        self._position = index + 1
+        return index, frame
+
+    def _read_runs(self, runs, seek_threshold, stats, size):
+        for run in runs:
+            if run[0] < self._position or run[0] - self._position > seek_threshold:
+                if self._seek(run[0]):
+                    stats["seeks"] += 1
+
+            for i in run:
+                item = self._next()
+                while item is not None and item[0] < i:
+                    stats["decoded"] += 1
+                    item = self._next()
+                if item is None:
+                    # End of stream or a broken packet: let the next run seek past it
+                    break
+                index, frame = item
+                if index > i:
+                    # Frame i is missing from the stream; the one decoded may be requested next
+                    self._pending = item
+                    continue
+                stats["decoded"] += 1
+                if size is not None:
+                    image = frame.reformat(width=size[0], height=size[1], format="gray").to_ndarray()
+                else:
+                    image = frame.to_ndarray(format="bgr24")
+                stats["kept"] += 1
+                yield i, image
+
+    def close(self):
+        self._container.close()
+        self._file.close()
+        self._bytes_closed += self._file.bytes_read
+        self._file.bytes_read = 0
@@ -1,11 +1,23 @@
 import os
-import shutil
-import yaml  # Ensure PyYAML is installed: pip install pyyaml
+import json
 import random
+import shutil
+import hashlib
 import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataprep.metrics import current_stage, staged
+from dataprep.shards import SHARD_SIZE, ShardWriter
+from dataprep.transfer import format_summary, transfer_files
 
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+SPLIT_MANIFEST = "split_manifest.json"
 
-def prepare_yolo_dataset(base_folder, source_images_folder, train_percentage):
+
+@staged("prepare_yolo_dataset")
+def prepare_yolo_dataset(base_folder, source_images_folder, train_percentage, transfer_mode="auto", transfer_workers=8,
+                         stream_zip=False, zip_workers=1, split_mode="random", group_by_video=False, shards=False,
+                         shard_size=SHARD_SIZE, data_root='/content'):
     """
     Prepare YOLO dataset by copying images and splitting them into train and val sets.
 
@@ -13,6 +25,23 @@ def prepare_yolo_dataset(base_folder, source_images_folder, train_percentage):
         base_folder (str): Path to the YOLO dataset base folder (e.g., 'C:\\Users\\wl077\\Downloads\\yolotest').
         source_images_folder (str): Path to the folder containing image files.
         train_percentage (int): Percentage of data to assign to the train set (0-100).
+        transfer_mode (str): How images and labels are placed: "auto" tries a hardlink, then a reflink,
+            then copies (see `dataprep.transfer.transfer_file`).
+        transfer_workers (int): Number of concurrent file transfers.
+        stream_zip (bool): Decide the split from the archive's member list and write each label straight
+            to 'labels/train' or 'labels/val' instead of extracting everything and copying the val labels.
+        zip_workers (int): Number of threads decompressing members in parallel when `stream_zip` is set.
+        split_mode (str): "random" reshuffles on every run. "hash" assigns each sample by a stable hash of
+            its name and records it in 'split_manifest.json', so reruns keep earlier assignments and only
+            new or changed samples are written (see `split_labels`). A rerun with another
+            `train_percentage` or `group_by_video` reassigns all samples.
+        group_by_video (bool): In "hash" mode, hash the video name (the part before '_img') instead of
+            the frame name, so all frames of a recording end up in the same split.
+        shards (bool): Instead of filling 'images/train' and 'images/val', write each split as tar shards
+            of image + label pairs to 'shards/' (see `dataprep.shards.ShardWriter`) and point data.yaml
+            at them, so the dataset moves as a few large files.
+        shard_size (int): Target maximum size of a shard in bytes.
+        data_root (str): Folder the dataset is read from at training time, written into data.yaml.
     """
     zip_files = [f for f in os.listdir(base_folder) if f.endswith('.zip')]
 
@@ -25,12 +54,6 @@ def prepare_yolo_dataset(base_folder, source_images_folder, train_percentage):
         # Ensure extraction folder exists
         os.makedirs(extract_folder, exist_ok=True)
 
-        # Extract ZIP file
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_folder)
-        print(f"Extracted {zip_files[0]} to {extract_folder}")
-
-
         # Define the labels and images folders based on the base folder
         labels_train_folder = os.path.join(extract_folder, "labels", "train")
         labels_val_folder = os.path.join(extract_folder, "labels", "val")
@@ -42,86 +65,359 @@ def prepare_yolo_dataset(base_folder, source_images_folder, train_percentage):
         os.makedirs(images_train_folder, exist_ok=True)
         os.makedirs(images_val_folder, exist_ok=True)
 
+        settings = {"train_percentage": train_percentage, "group_by_video": group_by_video}
+        manifest = load_split_manifest(extract_folder, settings) if split_mode == "hash" else None
+        previous = {stem: entry["split"] for stem, entry in manifest.items()} if manifest else None
+
+        if stream_zip:
+            # Labels go straight from the archive to their split folder
+            train_files, val_files, written = stream_yolo_zip(zip_path, extract_folder, train_percentage, zip_workers,
+                                                              split_mode, group_by_video, manifest)
+            val_labels_folder = None
+            current_stage()["labels_written"] = written
+            print(f"Streamed {written} new or changed labels from {zip_files[0]} to {extract_folder}")
+        else:
+            # Extract ZIP file
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                zip_ref.extractall(extract_folder)
+                current_stage().add("bytes_read", sum(info.compress_size for info in zip_ref.infolist()))
+            print(f"Extracted {zip_files[0]} to {extract_folder}")
+
+            # Check if labels/train folder exists
+            if not os.path.isdir(labels_train_folder):
+                raise FileNotFoundError(f"Labels folder not found: {labels_train_folder}")
+
+            # Get all .txt files in the labels/train folder
+            label_files = []
+            for root, _, files in os.walk(labels_train_folder):
+                for f in files:
+                    if not f.startswith("."):
+                        label_files.append(os.path.join(root, f))
+
+            train_files, val_files = split_labels(label_files, train_percentage, split_mode, group_by_video,
+                                                  previous)
+            val_labels_folder = labels_val_folder
+            if manifest is not None:
+                manifest.clear()
+                manifest.update({_stem(f): {"split": "train"} for f in train_files})
+                manifest.update({_stem(f): {"split": "val"} for f in val_files})
+
+        # Remove samples that left a split (or the export) since the last run
+        train_stems = {_stem(f).lower() for f in train_files}
+        val_stems = {_stem(f).lower() for f in val_files}
+        prune_folder(images_train_folder, train_stems)
+        prune_folder(images_val_folder, val_stems)
+        prune_folder(labels_val_folder, val_stems)
+        if stream_zip:
+            prune_folder(labels_train_folder, train_stems)
+
+        # Resolve every label against one index of the source images
+        image_index, collisions = index_images(source_images_folder)
+        if collisions:
+            print(f"Warning: {len(collisions)} image names match several files in {source_images_folder}. "
+                  f"Using the first of each:")
+            for stem in sorted(collisions)[:10]:
+                print(f"  {stem}: {', '.join(collisions[stem])}")
+            if len(collisions) > 10:
+                print(f"  ... and {len(collisions) - 10} more")
+
+        # Collect the files of each split, then transfer them together
+        transfers = []
+        samples = {"train": [], "val": []}
+        unmatched = []
+        for split, split_files, labels_folder, images_folder in [
+                ("train", train_files, None, images_train_folder),
+                ("val", val_files, val_labels_folder, images_val_folder)]:
+            for label_path in split_files:
+                label_file = os.path.basename(label_path)
+                base_name = os.path.splitext(label_file)[0]
+                image_file = image_index.get(base_name.lower())
+                if image_file is None:
+                    unmatched.append(label_file)
+                elif shards:
+                    # The image and its label go into the shard under the label's name
+                    samples[split].append((base_name, [(os.path.splitext(image_file)[1], image_file),
+                                                       (".txt", label_path)]))
+                if shards:
+                    continue
+
+                # Copy label file to val folder (train labels are already in place)
+                if labels_folder:
+                    transfers.append((label_path, os.path.join(labels_folder, label_file)))
+
+                # Copy corresponding image file to the split folder
+                if image_file:
+                    # Named after the label, so YOLO pairs them even when the case differs
+                    image_name = base_name + os.path.splitext(image_file)[1]
+                    transfers.append((image_file, os.path.join(images_folder, image_name)))
+
+        current_stage().update(split_mode=split_mode, train=len(train_files), val=len(val_files),
+                               unmatched=len(unmatched))
+        if unmatched:
+            print(f"Warning: No matching image found for {len(unmatched)} label files: {', '.join(sorted(unmatched))}")
+
+        summary = transfer_files(transfers, transfer_mode, transfer_workers)
+        print(f"Transferred {format_summary(summary)}")
+
+        shard_names = None
+        if shards:
+            shards_folder = os.path.join(extract_folder, "shards")
+            shard_names = {}
+            for split in ("train", "val"):
+                with ShardWriter(shards_folder, split, shard_size) as writer:
+                    for key, files in samples[split]:
+                        writer.write(key, files)
+                shard_names[split] = [shard["name"] for shard in writer.shards]
+                current_stage().add("shards", len(writer.shards))
+                print(f"Wrote {len(samples[split])} {split} samples to {len(writer.shards)} shards "
+                      f"({sum(shard['bytes'] for shard in writer.shards) / 1e6:.1f} MB), index {writer.index_path}")
 
-        # Check if labels/train folder exists
-        if not os.path.isdir(labels_train_folder):
-            raise FileNotFoundError(f"Labels folder not found: {labels_train_folder}")
+        print(f"Train and val split completed. Train: {len(train_files)} frames, Val: {len(val_files)} frames")
 
-        # Get all .txt files in the labels/train folder
-        label_files = []
-        for root, _, files in os.walk(labels_train_folder):
-            for f in files:
-                if not f.startswith("."):
-                    label_files.append(os.path.join(root, f))
+        if manifest is not None:
+            save_split_manifest(extract_folder, manifest, settings)
 
-        # Shuffle the label files
-        random.shuffle(label_files)
+        # Update the data.yaml file
+        update_data_yaml(extract_folder, data_root, shard_names)
+        delete_train_txt(extract_folder)
 
-        # Calculate the split index
-        split_index = int(len(label_files) * train_percentage / 100)
 
-        # Split into train and val
-        train_files = label_files[:split_index]
-        val_files = label_files[split_index:]
 
-        # Process train files
-        for label_path in train_files:
-            label_file = os.path.basename(label_path)
-            base_name = os.path.splitext(label_file)[0]
-        
-            # Copy label file to train folder
-            # shutil.copy(label_path, os.path.join(labels_train_folder, label_file))
-        
-            # Copy corresponding image file to train folder
-            for ext in ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']:
-                image_file = os.path.join(source_images_folder, base_name + ext)
-                if os.path.exists(image_file):
-                    shutil.copy(image_file, os.path.join(images_train_folder, os.path.basename(image_file)))
-                    break
-            else:
-                print(f"Warning: No matching image found for label file '{label_file}'")
-
-            # Copy corresponding image file to train folder
-            # for ext in ['.jpg', '.jpeg', '.png']:
-            #     image_file = os.path.join(source_images_folder, base_name + ext)
-            #     if os.path.exists(image_file):
-            #         shutil.copy(image_file, os.path.join(images_train_folder, base_name + ext))
-            #         break
-            # else:
-            #     print(f"Warning: No matching image found for label file '{label_file}'")
-
-        # Process val files
-        for label_path in val_files:
-            label_file = os.path.basename(label_path)
-            base_name = os.path.splitext(label_file)[0]
-        
-            # Copy label file to val folder
-            shutil.copy(label_path, os.path.join(labels_val_folder, label_file))
-        
-            # Copy corresponding image file to val folder
-            for ext in ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']:
-                image_file = os.path.join(source_images_folder, base_name + ext)
-                if os.path.exists(image_file):
-                    shutil.copy(image_file, os.path.join(images_val_folder, os.path.basename(image_file)))
-                    break
-            else:
-                print(f"Warning: No matching image found for label file '{label_file}'")
+def index_images(folder, extensions=IMAGE_EXTENSIONS):
+    """
+    Map the lower-cased stem of every image in `folder` to its path, with a single `os.scandir`.
 
-        print(f"Train and val split completed. Train: {len(train_files)} frames, Val: {len(val_files)} frames")
+    When several files share a stem (e.g. 'a.png' and 'A.jpg'), the one whose extension comes first
+    in `extensions` is used and the stem is reported as a collision.
 
-        # Update the data.yaml file
-        update_data_yaml(extract_folder)
-        delete_train_txt(extract_folder)
+    Args:
+        folder (str): Folder containing the images (not searched recursively).
+        extensions (Tuple[str]): Image extensions in order of preference, lower case.
+
+    Returns:
+        Tuple[dict, dict]: {stem: path}, and {stem: [paths]} for the stems matching several files.
+    """
+    candidates = {}
+    with os.scandir(folder) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            if ext.lower() in extensions and entry.is_file():
+                candidates.setdefault(stem.lower(), []).append(entry.path)
+
+    def preference(path):
+        name = os.path.basename(path)
+        return extensions.index(os.path.splitext(name)[1].lower()), name
+
+    index = {}
+    collisions = {}
+    for stem, paths in candidates.items():
+        paths.sort(key=preference)
+        index[stem] = paths[0]
+        if len(paths) > 1:
+            collisions[stem] = paths
+    return index, collisions
+
+
+def split_labels(label_files, train_percentage, split_mode="random", group_by_video=False, previous=None):
+    """
+    Split label files into train and val lists.
+
+    In "random" mode the files are shuffled and cut at `train_percentage`. In "hash" mode each file is
+    assigned by a stable hash of its stem (or of its video name with `group_by_video`), so the
+    assignment does not depend on the other files, and stems found in `previous` keep their split.
+    With `group_by_video`, a new frame of a video found in `previous` joins that video's split.
+
+    Args:
+        label_files (List[str]): Label files or archive members.
+        train_percentage (int): Percentage of data to assign to the train set (0-100).
+        split_mode (str): "random" or "hash".
+        group_by_video (bool): In "hash" mode, hash the part of the stem before '_img'.
+        previous (dict, optional): {stem: "train" or "val"} from an earlier run ("hash" mode only).
+
+    Returns:
+        Tuple[List[str], List[str]]: Train and val label files.
+    """
+    label_files = list(label_files)
+    if split_mode == "hash":
+        # Earlier assignments are looked up by the hashed key, so a group stays in one split
+        previous = {_split_key(stem, group_by_video): split for stem, split in (previous or {}).items()}
+        train, val = [], []
+        for label_file in sorted(label_files):
+            key = _split_key(_stem(label_file), group_by_video)
+            split = previous.get(key) or hash_split(key, train_percentage)
+            (train if split == "train" else val).append(label_file)
+        return train, val
+    if split_mode != "random":
+        raise ValueError(f"Unknown split mode: {split_mode}")
+
+    # Shuffle the label files
+    random.shuffle(label_files)
 
+    # Calculate the split index
+    split_index = int(len(label_files) * train_percentage / 100)
 
+    # Split into train and val
+    return label_files[:split_index], label_files[split_index:]
 
-def update_data_yaml(base_folder):
+
+def _split_key(stem, group_by_video=False):
+    """Key a sample is hashed by: its stem, or with `group_by_video` the part before '_img'."""
+    return stem[:stem.find('_img')] if group_by_video and '_img' in stem else stem
+
+
+def hash_split(key, train_percentage):
+    """Stable train/val assignment of a sample key: the first 32 bits of its SHA-1 as a fraction of 1."""
+    value = int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16) / 0x100000000
+    return "train" if value < train_percentage / 100 else "val"
+
+
+def load_split_manifest(extract_folder, settings=None):
+    """
+    Load the split assignments of earlier "hash" runs: {stem: {"split": ..., "crc": ...}}.
+
+    The manifest also records the split settings ("train_percentage", "group_by_video") it was made
+    with. If they differ from `settings`, or are missing (manifests written before they were recorded),
+    the earlier assignments no longer apply and an empty manifest is returned, so every sample is
+    assigned again.
+    """
+    path = os.path.join(extract_folder, SPLIT_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        data = json.load(f)
+    if settings is not None and data.get("settings") != settings:
+        print(f"Split settings changed from {data.get('settings')} to {settings}: reassigning all samples")
+        return {}
+    return data.get("samples", {})
+
+
+def save_split_manifest(extract_folder, manifest, settings=None):
+    path = os.path.join(extract_folder, SPLIT_MANIFEST)
+    with open(path + ".tmp", 'w') as f:
+        json.dump({"settings": settings, "samples": manifest}, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def prune_folder(folder, keep_stems):
+    """
+    Delete the files of `folder` whose lower-cased stem is not in `keep_stems` (one `os.scandir`).
+
+    Returns:
+        int: Number of files deleted.
+    """
+    removed = 0
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.is_file() and os.path.splitext(entry.name)[0].lower() not in keep_stems:
+                os.remove(entry.path)
+                removed += 1
+    return removed
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def stream_yolo_zip(zip_path, extract_folder, train_percentage, workers=1, split_mode="random",
+                    group_by_video=False, manifest=None):
+    """
+    Ingest a CVAT YOLO export without a full `extractall`.
+
+    The member list is read once and the members under 'labels/train' are split into train and val
+    up front. Every member is then decompressed directly to its final path: labels to 'labels/train'
+    or 'labels/val', everything else (data.yaml, train.txt, ...) to the same relative path as before.
+
+    With a `manifest`, labels whose CRC and split are unchanged since the last run (and whose file
+    still exists) are skipped, and the manifest is updated in place. The compressed size of the
+    members decompressed is added to "bytes_read" of the current stage (see `dataprep.metrics`).
+
+    Args:
+        zip_path (str): Path of the ZIP archive.
+        extract_folder (str): Folder the dataset is written to.
+        train_percentage (int): Percentage of labels to assign to the train set (0-100).
+        workers (int): Number of threads decompressing members in parallel (each with its own handle).
+        split_mode (str): "random" or "hash", see `split_labels`.
+        group_by_video (bool): In "hash" mode, keep the frames of a video in the same split.
+        manifest (dict, optional): Split manifest of earlier runs (see `load_split_manifest`).
+
+    Returns:
+        Tuple[List[str], List[str], int]: Paths of the train and val label files, and the number of
+        labels actually written.
+    """
+    label_prefix = "labels/train/"
+    root = os.path.abspath(extract_folder)
+
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        members = [info for info in zip_ref.infolist() if not info.is_dir()]
+
+    labels = [m.filename for m in members
+              if m.filename.startswith(label_prefix) and not os.path.basename(m.filename).startswith(".")]
+    previous = {stem: entry["split"] for stem, entry in manifest.items()} if manifest else None
+    train_labels, val_labels = split_labels(labels, train_percentage, split_mode, group_by_video, previous)
+    val_labels = set(val_labels)
+    label_set = set(labels)
+
+    destinations = {}
+    written = 0
+    new_manifest = {}
+    for member in members:
+        name = member.filename
+        if name in val_labels:
+            name = "labels/val/" + name[len(label_prefix):]
+        target = os.path.abspath(os.path.join(root, *name.split("/")))
+        if os.path.commonpath([root, target]) != root:
+            raise ValueError(f"Unsafe path in archive {zip_path}: {member.filename}")
+        if member.filename in label_set:
+            entry = {"split": "val" if member.filename in val_labels else "train", "crc": member.CRC}
+            new_manifest[_stem(member.filename)] = entry
+            if manifest is not None and manifest.get(_stem(member.filename)) == entry and os.path.exists(target):
+                continue
+            written += 1
+        destinations[member.filename] = target
+    if manifest is not None:
+        manifest.clear()
+        manifest.update(new_manifest)
+    current_stage().add("bytes_read", sum(m.compress_size for m in members if m.filename in destinations))
+
+    local = threading.local()
+    handles = []
+
+    def extract(name):
+        # ZipFile handles are not shared between threads
+        if not hasattr(local, "zip_ref"):
+            local.zip_ref = zipfile.ZipFile(zip_path, 'r')
+            handles.append(local.zip_ref)
+        os.makedirs(os.path.dirname(destinations[name]), exist_ok=True)
+        with local.zip_ref.open(name) as src, open(destinations[name], 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for _ in pool.map(extract, destinations):
+                pass
+    finally:
+        for handle in handles:
+            handle.close()
+
+    def label_path(name, split):
+        return os.path.join(root, "labels", split, *name[len(label_prefix):].split("/"))
+
+    return ([label_path(name, "train") for name in train_labels],
+            [label_path(name, "val") for name in sorted(val_labels)], written)
+
+
+def update_data_yaml(base_folder, data_root='/content', shards=None):
     """
     Update the first YAML file found in the base folder.
 
     Args:
         base_folder (str): Path to the folder containing YAML files (e.g., 'C:\\Users\\wl077\\Downloads\\yolotest').
+        data_root (str): Folder the dataset is read from at training time (the Colab default is '/content').
+        shards (dict, optional): {"train": [shard names], "val": [shard names]} in 'shards/'. When given,
+            'train' and 'val' list the shards instead of the image folders.
     """
+    import yaml  # Ensure PyYAML is installed: pip install pyyaml
+
     # Scan for YAML files in the folder
     yaml_files = [f for f in os.listdir(base_folder) if f.endswith('.yaml')]
 
@@ -136,10 +432,14 @@ def update_data_yaml(base_folder):
         data = yaml.safe_load(file)
 
     # Update the fields
-    base_folder2 = os.path.join('/content', base_folder)
+    base_folder2 = os.path.join(data_root, base_folder)
     data['path'] = base_folder2
-    data['train'] = os.path.join(base_folder2, "images", "train")
-    data['val'] = os.path.join(base_folder2, "images", "val")
+    if shards:
+        data['train'] = [os.path.join(base_folder2, "shards", name) for name in shards["train"]]
+        data['val'] = [os.path.join(base_folder2, "shards", name) for name in shards["val"]]
+    else:
+        data['train'] = os.path.join(base_folder2, "images", "train")
+        data['val'] = os.path.join(base_folder2, "images", "val")
 
     # Write back the updated YAML file
     with open(yaml_file_path, 'w') as file:
@@ -11,6 +11,9 @@ setup(
         # "tensorpack", 
         # "tensorflow==2.12.0",
     ],
+    extras_require={
+        "pyav": ["av"],  # multithreaded decoding, see dataprep.video_reader
+    },
     description="A library for learning tracking",
     author="WL",
     author_email="wl0777@outlook.com",
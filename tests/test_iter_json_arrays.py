@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from dataprep.json2dlc import CocoAnnotations, iter_json_arrays
+
+DOCUMENT = {
+    "n": -0.125,
+    "licenses": [{"name": "a ]},[ b", "url": ""}, [[1, [2, {"x": "]"}]], []]],
+    "info": {"version": "1.0e3", "nested": [[-1.5e-3, 2E+2], {"s": "\"[{"}], "flag": True, "none": None},
+    "categories": [{"id": 1, "name": "mouse", "keypoints": ["nose", "tail"], "skeleton": [[1, 2]]}],
+    "ratio": 6.02e23,
+    "images": [
+        {"id": 1, "file_name": "v1_img0000.png", "width": 640, "height": 480},
+        {"id": 2, "file_name": "odd ]},[ name é\\.png", "width": 64.5, "height": -0.0},
+    ],
+    "empty": [],
+    "annotations": [
+        {"id": 1, "image_id": 1, "category_id": 1, "keypoints": [10.25, -3.5e1, 2, 0, 0, 0],
+         "segmentation": [[1, 2, 3]], "attributes": {"text": "},]"}},
+        {"id": 2, "image_id": 2, "category_id": 1, "keypoints": [1e-7, 12345678901234567890, 1, 0.5, 7, 2]},
+    ],
+    "tail": -7,
+}
+KEYS = ("categories", "images", "annotations")
+
+
+@pytest.fixture(params=["compact", "indented"])
+def js_file(request, tmp_path):
+    path = tmp_path / "annotations.json"
+    indent = 1 if request.param == "indented" else None
+    path.write_text(json.dumps(DOCUMENT, indent=indent, ensure_ascii=False), encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", list(range(1, 40)) + [64, 127, 1 << 20])
+def test_matches_json_load(js_file, chunk_size):
+    with open(js_file, 'r') as f:
+        data = json.load(f)
+    expected = [(key, item) for key in data if key in KEYS for item in data[key]]
+    assert list(iter_json_arrays(js_file, KEYS, chunk_size)) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5, 13])
+def test_streaming_load_keeps_fields(js_file, chunk_size):
+    coco = CocoAnnotations.load(js_file, streaming=True, chunk_size=chunk_size)
+    assert coco.categories == DOCUMENT["categories"]
+    assert [image["file_name"] for image in coco.images] == [image["file_name"] for image in DOCUMENT["images"]]
+    assert [a["keypoints"] for a in coco.annotations] == [a["keypoints"] for a in DOCUMENT["annotations"]]
+    assert all(set(a) == {"image_id", "category_id", "keypoints"} for a in coco.annotations)
+
+
+def test_rejects_non_object(tmp_path):
+    path = tmp_path / "list.json"
+    path.write_text("[1, 2]")
+    with pytest.raises(ValueError):
+        list(iter_json_arrays(str(path), KEYS))
@@ -0,0 +1,88 @@
+import random
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from dataprep.video_reader import frame_timestamps, is_constant_rate, open_video
+
+av = pytest.importorskip("av")
+cv2 = pytest.importorskip("cv2")
+
+NUM_FRAMES = 300
+
+
+def frame_image(i, width=64, height=48):
+    """A frame that differs from its neighbours in brightness, a moving bar and a band of color."""
+    image = np.full((height, width, 3), (i * 7) % 256, np.uint8)
+    x = (i * 3) % (width - 8)
+    image[:, x:x + 8] = 255 - i % 50
+    image[(i % 6) * 8:(i % 6) * 8 + 8, :, 1] = (i * 13) % 256
+    return image
+
+
+def write_h264(path, steps_ms):
+    """H.264 with B-frames, a keyframe every 12 frames and the given frame durations in milliseconds."""
+    with av.open(str(path), "w") as container:
+        stream = container.add_stream("libx264", rate=25)
+        stream.width, stream.height, stream.pix_fmt = 64, 48, "yuv420p"
+        stream.codec_context.gop_size = 12
+        stream.codec_context.options = {"bf": "3"}
+        stream.codec_context.time_base = Fraction(1, 1000)
+        pts = 0
+        for i in range(NUM_FRAMES):
+            frame = av.VideoFrame.from_ndarray(frame_image(i), format="bgr24")
+            frame.pts, frame.time_base = pts, Fraction(1, 1000)
+            pts += steps_ms[i % len(steps_ms)]
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+@pytest.fixture(scope="module", params=["bframes", "variable_rate"])
+def video(request, tmp_path_factory):
+    path = tmp_path_factory.mktemp("videos") / f"{request.param}.mp4"
+    if request.param == "bframes":
+        write_h264(path, [40])
+    else:
+        write_h264(path, random.Random(0).choices([20, 33, 50], k=NUM_FRAMES))
+
+    cap = cv2.VideoCapture(str(path))
+    frames = []
+    ok, frame = cap.read()
+    while ok:
+        frames.append(frame)
+        ok, frame = cap.read()
+    cap.release()
+    assert len(frames) == NUM_FRAMES
+    return str(path), frames
+
+
+def test_frame_timestamps(video):
+    path, _ = video
+    timestamps = frame_timestamps(path)
+    assert len(timestamps) == NUM_FRAMES
+    assert is_constant_rate(timestamps) == path.endswith("bframes.mp4")
+
+
+@pytest.mark.parametrize("backend", ["opencv", "pyav"])
+@pytest.mark.parametrize("seek_threshold", [0, 5, 1000])
+def test_read_matches_sequential_read(video, backend, seek_threshold):
+    path, frames = video
+    indices = sorted(random.Random(seek_threshold).sample(range(NUM_FRAMES), 30))
+    with open_video(path, backend) as reader:
+        assert reader.frame_count == NUM_FRAMES
+        stats = {}
+        read = dict(reader.read(indices, seek_threshold, stats))
+        assert sorted(read) == indices
+        for i in indices:
+            np.testing.assert_array_equal(read[i], frames[i], err_msg=f"frame {i}")
+        assert stats["kept"] == len(indices)
+
+        # Earlier frames again, from the same reader
+        earlier = indices[:5]
+        read = dict(reader.read(earlier, seek_threshold))
+        assert sorted(read) == earlier
+        for i in earlier:
+            np.testing.assert_array_equal(read[i], frames[i], err_msg=f"frame {i}")